@@ -0,0 +1,236 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import fetch_scheduler
+import http_cache
+import institutional_store
+import memory_budget
+import price_store
+import screens
+import trading_calendar
+from data_paths import read_properties
+from momentum import compute_features, quotes_to_series, series_to_matrices
+from logger_config import setup_logger
+
+# Set up the logger
+logger = setup_logger()
+
+# Trading days after the signal day of the forward returns
+DEFAULT_FORWARD_DAYS = (1, 5, 10, 20)
+
+# Trading days evaluated per worker task, each shard also loads its own lookback and forward days
+DEFAULT_SHARD_DAYS = 20
+
+# Function to list the trading days from start to end (inclusive), oldest first
+def get_trading_days(start, end):
+    days = []
+    for year in range(start.year, end.year + 1):
+        days += [day for day in trading_calendar.get_calendar(year).trading_days if start <= day <= end]
+    return days
+
+# Function to load the stored quotes of both markets for a date, returns {stock_number: [close, volume]} or None if not stored
+# Backtests only read the local store, run with --fetch to download missing days first
+def load_quotes(day):
+    quotes = {}
+    for market in institutional_store.MARKETS:
+        market_quotes = price_store.load_snapshot(market, datetime.combine(day, datetime.min.time()))
+        if market_quotes is None:
+            return None
+        quotes.update({stock_number: quote if isinstance(quote, list) else [quote, None] for stock_number, quote in market_quotes.items()})
+    return quotes
+
+# Function to load the stored institutional flows of both markets for a date, returns [flows per market] or None if not stored
+def load_flows(day):
+    flows = [institutional_store.load_flows(market, datetime.combine(day, datetime.min.time())) for market in institutional_store.MARKETS]
+    return None if None in flows else flows
+
+# Function to evaluate the screens on every day of one shard, runs in a worker process
+# days holds the shard's lookback days, the shard days and its forward days; [first, last) are evaluated
+def run_shard(days, first, last, screen_list, windows, forward_days):
+    # Replay the flows before the shard so the streaks are warm on its first day
+    streaks = {}
+    streak_days = {}
+    missing_flows = 0
+    for position in range(max(0, first - institutional_store.STREAK_MAX_DAYS), last):
+        flows = load_flows(days[position])
+        if flows is None:
+            # A gap makes every streak unknown, start counting again
+            streaks = {}
+            if position >= first:
+                missing_flows += 1
+        else:
+            streaks = _apply_day(streaks, flows)
+        if position >= first:
+            streak_days[days[position]] = streaks
+
+    # Float32 quote matrices over the whole shard context, each day's dict is dropped once converted
+    rows = {}
+    for day in days:
+        quotes = load_quotes(day)
+        if quotes:
+            rows[day] = quotes_to_series(quotes)
+    close_matrix, volume_matrix = series_to_matrices(rows)
+    dates = list(close_matrix.index)
+    positions = {day: position for position, day in enumerate(dates)}
+
+    min_cont_buy_days = screens.get_min_cont_buy_days(screen_list)
+    hits = []
+    skipped_days = []
+    for day in days[first:last]:
+        if day not in positions:
+            skipped_days.append(day.isoformat())
+            continue
+
+        candidates = [stock_number for stock_number, streak in streak_days[day].items() if streak >= min_cont_buy_days]
+        if not candidates:
+            continue
+
+        position = positions[day]
+        history = slice(max(0, position - max(windows)), position + 1)
+        features = compute_features(close_matrix.iloc[history].reindex(columns=candidates),
+                                    volume_matrix.iloc[history].reindex(columns=candidates), windows)
+
+        table = features.drop(columns=['close']).reset_index(drop=True)
+        table.insert(0, '代號', candidates)
+        table.insert(1, '外資連續買賣日數', [streak_days[day][stock_number] for stock_number in candidates])
+        masks = screens.evaluate(table, screen_list)
+
+        # Forward returns from the signal day's close, NaN when the store doesn't reach that far
+        latest = features['close'].to_numpy()
+        forward_returns = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for n in forward_days:
+                if position + n < len(dates):
+                    later = close_matrix.iloc[position + n].reindex(candidates).to_numpy()
+                    forward_returns[f'forward_{n}d'] = np.round((later - latest) / latest * 100, 2)
+                else:
+                    forward_returns[f'forward_{n}d'] = np.full(len(candidates), np.nan)
+        table = table.assign(**forward_returns)
+
+        for screen in screen_list:
+            selected = table[masks[screen['name']]]
+            if not selected.empty:
+                hits.append(selected.assign(trade_date=day.isoformat(), screen=screen['name']))
+
+    hits = pd.concat(hits, ignore_index=True) if hits else pd.DataFrame()
+    return hits, skipped_days, missing_flows
+
+# Function to advance the streaks of both markets by one day, a stored closure (no flows) keeps them
+def _apply_day(streaks, flows):
+    if not any(flows):
+        return streaks
+    updated = {}
+    for market_flows in flows:
+        if market_flows:
+            updated.update(institutional_store.apply_flows(streaks, market_flows))
+    return updated
+
+# Function to download the quotes and flows missing from the local store, throttled per host by the fetch scheduler
+def fetch_missing(days):
+    from stock_info import get_daily_quotes
+
+    def fetch_day(day):
+        date_time = datetime.combine(day, datetime.min.time())
+        quotes = get_daily_quotes(date_time)
+        flows = [institutional_store.get_flows(market, date_time) for market in institutional_store.MARKETS]
+        return quotes is not None and None not in flows
+
+    missing = [day for day in days if load_quotes(day) is None or load_flows(day) is None]
+    logger.info(f"Downloading {len(missing)} of {len(days)} trading days missing from the local store")
+    results = fetch_scheduler.map_concurrently(fetch_day, missing)
+    failed = [day.isoformat() for day, fetched in zip(missing, results) if not fetched]
+    if failed:
+        logger.error(f"Fail to download {len(failed)} trading days: {', '.join(failed)}")
+
+# Function to summarize the hits of each screen: hit days, hits, average and win rate of every forward return
+def summarize(hits, forward_days):
+    if hits.empty:
+        return pd.DataFrame()
+    summary = hits.groupby('screen').agg(hit_days=('trade_date', 'nunique'), hits=('代號', 'size'))
+    for n in forward_days:
+        column = f'forward_{n}d'
+        summary[f'avg_{column}'] = hits.groupby('screen')[column].mean().round(2)
+        summary[f'win_{column}'] = hits.groupby('screen')[column].apply(lambda returns: round((returns.dropna() > 0).mean() * 100, 1))
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the configured screens over a date range from the local price and institutional stores')
+    parser.add_argument('--start', required=True, help='first trading date (YYYYMMDD)')
+    parser.add_argument('--end', default=(datetime.now() - timedelta(days=1)).strftime('%Y%m%d'), help='last trading date (YYYYMMDD), default yesterday')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--shard-days', type=int, default=DEFAULT_SHARD_DAYS, help='trading days per worker task')
+    parser.add_argument('--forward', default=','.join(str(n) for n in DEFAULT_FORWARD_DAYS), help='forward return horizons in trading days')
+    parser.add_argument('--fetch', action='store_true', help='download the days missing from the local store first')
+    parser.add_argument('--output', default='backtest_hits.csv', help='CSV file of the per-day hits')
+    args = parser.parse_args()
+
+    # Same config as the daily report
+    properties = read_properties()
+    fetch_scheduler.configure(properties)
+    http_cache.configure(properties)
+    memory_budget.configure(properties)
+    screen_list = screens.load_screens(properties)
+    windows = screens.get_feature_windows(screen_list)
+    forward_days = tuple(int(n) for n in args.forward.split(','))
+
+    start = datetime.strptime(args.start, '%Y%m%d').date()
+    end = datetime.strptime(args.end, '%Y%m%d').date()
+    days = get_trading_days(start, end)
+    if not days:
+        logger.error("No trading days in the range.")
+        return
+
+    # Lookback for the features and streaks before the range, forward days after it
+    lookback = max(max(windows), institutional_store.STREAK_MAX_DAYS)
+    earlier_days = trading_calendar.previous_trading_days(days[0], lookback)
+    later_days = get_trading_days(end + timedelta(days=1), datetime.now().date())[:max(forward_days)]
+    all_days = earlier_days + days + later_days
+
+    if args.fetch:
+        fetch_missing(all_days)
+
+    # Contiguous date shards, each worker only loads the days its shard needs
+    first_position = len(earlier_days)
+    tasks = []
+    for shard_start in range(first_position, first_position + len(days), args.shard_days):
+        shard_end = min(shard_start + args.shard_days, first_position + len(days))
+        context_start = max(0, shard_start - lookback)
+        context = all_days[context_start:shard_end + max(forward_days)]
+        tasks.append((context, shard_start - context_start, shard_end - context_start))
+
+    # With "memory_budget_mb" only as many workers as fit in the budget are started
+    workers = memory_budget.cap_workers(args.workers)
+    logger.info(f"Backtesting {len(days)} trading days in {len(tasks)} shards with {workers} workers")
+    all_hits = []
+    skipped_days = []
+    missing_flows = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_shard, context, first, last, screen_list, windows, forward_days) for context, first, last in tasks]
+        for future in futures:
+            hits, skipped, missing = future.result()
+            all_hits.append(hits)
+            skipped_days += skipped
+            missing_flows += missing
+
+    if skipped_days:
+        logger.warning(f"{len(skipped_days)} trading days without stored quotes were skipped, run with --fetch to download them")
+    if missing_flows:
+        logger.warning(f"Institutional flows missing for {missing_flows} trading days, streaks restarted after each gap")
+
+    hits = pd.concat(all_hits, ignore_index=True)
+    if not hits.empty:
+        columns = ['trade_date', 'screen'] + [column for column in hits.columns if column not in ('trade_date', 'screen')]
+        hits = hits[columns]
+    hits.to_csv(args.output, index=False, encoding='utf-8-sig')
+    logger.info(f"{len(hits)} hits written to {args.output}")
+
+    summary = summarize(hits, forward_days)
+    print(summary.to_string() if not summary.empty else 'No hits.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+import json
+import math
+import os
+import random
+import re
+from datetime import date, datetime, timedelta
+from urllib.parse import parse_qs, unquote
+
+# Folder with recorded responses, see record_fixtures.py
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+TWSE_STOCK_DAY_FIELDS = ['Date', 'Trade Volume', 'Trade Value', 'Opening Price', 'Highest Price', 'Lowest Price', 'Closing Price', 'Change', 'Transaction']
+
+T86_HEADER = ['證券代號', '證券名稱', '外陸資買進股數(不含外資自營商)', '外陸資賣出股數(不含外資自營商)', '外陸資買賣超股數(不含外資自營商)',
+              '外資自營商買進股數', '外資自營商賣出股數', '外資自營商買賣超股數', '投信買進股數', '投信賣出股數', '投信買賣超股數',
+              '自營商買賣超股數', '自營商買進股數(自行買賣)', '自營商賣出股數(自行買賣)', '自營商買賣超股數(自行買賣)',
+              '自營商買進股數(避險)', '自營商賣出股數(避險)', '自營商買賣超股數(避險)', '三大法人買賣超股數']
+
+TPEX_3INSTI_HEADER = ['代號', '名稱', '外資及陸資(不含外資自營商)-買進股數', '外資及陸資(不含外資自營商)-賣出股數', '外資及陸資(不含外資自營商)-買賣超股數',
+                      '外資自營商-買進股數', '外資自營商-賣出股數', '外資自營商-買賣超股數', '外資及陸資-買進股數', '外資及陸資-賣出股數', '外資及陸資-買賣超股數',
+                      '投信-買進股數', '投信-賣出股數', '投信-買賣超股數', '自營商(自行買賣)-買進股數', '自營商(自行買賣)-賣出股數', '自營商(自行買賣)-買賣超股數',
+                      '自營商(避險)-買進股數', '自營商(避險)-賣出股數', '自營商(避險)-買賣超股數', '自營商-買進股數', '自營商-賣出股數', '自營商-買賣超股數', '三大法人買賣超股數合計']
+
+# Function to build the file name of a recorded response from its request path and query
+def fixture_path(path, query):
+    endpoint = path.rstrip('/').split('/')[-1]
+    key = re.sub(r'[^0-9A-Za-z_.=-]+', '_', unquote(query)).strip('_') or 'default'
+    return os.path.join(FIXTURES_DIR, endpoint, key)
+
+def _taiwan_date(day):
+    return f'{day.year - 1911}/{day.strftime("%m/%d")}'
+
+def _number(value, decimals=0):
+    return f'{value:,.{decimals}f}'
+
+# A deterministic stand-in for both exchanges: every stock's prices are a pure function of (symbol, date)
+class SyntheticMarket:
+    def __init__(self, n_stocks, as_of: date, holidays=()):
+        self.as_of = as_of
+        self.holidays = set(holidays)
+        self.twse_symbols = [str(1101 + i) for i in range(n_stocks - n_stocks // 3)]
+        self.tpex_symbols = [str(5101 + i) for i in range(n_stocks // 3)]
+
+    def market_of(self, symbol):
+        if symbol in self.twse_symbols:
+            return 'TWSE'
+        if symbol in self.tpex_symbols:
+            return 'TPEX'
+        return None
+
+    def is_trading_day(self, day):
+        return day.weekday() < 5 and day not in self.holidays and day <= self.as_of
+
+    def trading_days_of_month(self, month_start):
+        day = month_start.replace(day=1)
+        days = []
+        while day.month == month_start.month:
+            if self.is_trading_day(day):
+                days.append(day)
+            day += timedelta(days=1)
+        return days
+
+    def quote(self, symbol, day):
+        rng = random.Random(int(symbol))
+        base = rng.uniform(10, 500)
+        period = rng.uniform(5, 40)
+        phase = rng.uniform(0, math.pi * 2)
+        close = round(base * (1 + 0.15 * math.sin(day.toordinal() / period + phase)), 2)
+        previous = round(base * (1 + 0.15 * math.sin((day.toordinal() - 1) / period + phase)), 2)
+        volume = int(base * 1000 * (2 + math.cos(day.toordinal() / 3 + phase)))
+        return {
+            'open': previous, 'high': max(close, previous) * 1.01, 'low': min(close, previous) * 0.99,
+            'close': close, 'change': round(close - previous, 2), 'volume': volume,
+        }
+
+    def foreign_net(self, symbol, day):
+        rng = random.Random(f'{symbol}-{day.isoformat()}')
+        # Roughly a third of the stocks are on a buying streak at any time
+        trend = math.sin(day.toordinal() / 9 + int(symbol))
+        return int((trend + rng.uniform(-0.5, 0.5)) * 100000)
+
+    def foreign_streak(self, symbol):
+        streak = 0
+        day = self.as_of
+        while streak < 60:
+            if self.is_trading_day(day):
+                net = self.foreign_net(symbol, day)
+                if net <= 0:
+                    break
+                streak += 1
+            day -= timedelta(days=1)
+        return streak
+
+    # STOCK_DAY (English) of one stock for one month
+    def twse_stock_day(self, query):
+        params = parse_qs(query)
+        symbol = params.get('stockNo', [''])[0]
+        month = datetime.strptime(params.get('date', [''])[0], '%Y%m%d').date()
+        days = self.trading_days_of_month(month)
+        if self.market_of(symbol) != 'TWSE' or not days:
+            return 'application/json', json.dumps({'stat': 'No data'}).encode()
+        rows = []
+        for day in days:
+            q = self.quote(symbol, day)
+            rows.append([day.strftime('%Y/%m/%d'), _number(q['volume']), _number(q['volume'] * q['close']), _number(q['open'], 2),
+                         _number(q['high'], 2), _number(q['low'], 2), _number(q['close'], 2), f"{q['change']:+.2f}", _number(q['volume'] // 1000)])
+        return 'application/json', json.dumps({'stat': 'OK', 'fields': TWSE_STOCK_DAY_FIELDS, 'data': rows}).encode()
+
+    # st43_result of one stock for one month
+    def tpex_st43(self, query):
+        params = parse_qs(query)
+        symbol = params.get('stkno', [''])[0]
+        taiwan_year, month = (int(part) for part in params.get('d', ['0/0'])[0].split('/')[:2])
+        days = self.trading_days_of_month(date(taiwan_year + 1911, month, 1))
+        if self.market_of(symbol) != 'TPEX' or not days:
+            return 'application/json', json.dumps({'iTotalRecords': 0, 'aaData': []}).encode()
+        rows = []
+        for day in days:
+            q = self.quote(symbol, day)
+            rows.append([_taiwan_date(day), _number(q['volume'] // 1000), _number(q['volume'] * q['close'] // 1000), _number(q['open'], 2),
+                         _number(q['high'], 2), _number(q['low'], 2), _number(q['close'], 2), f"{q['change']:+.2f}", _number(q['volume'] // 1000)])
+        return 'application/json', json.dumps({'iTotalRecords': len(rows), 'aaData': rows}, ensure_ascii=False).encode()
+
+    # MI_INDEX: all-market closes (ALLBUT0999, json) or the market summary (MS, csv)
+    def twse_mi_index(self, query):
+        params = parse_qs(query)
+        day = datetime.strptime(params.get('date', [''])[0], '%Y%m%d').date()
+        if params.get('type', [''])[0] == 'MS':
+            body = f'"{_taiwan_date(day)} 大盤統計資訊"\n"指數","收盤指數"\n"發行量加權股價指數","17,000.00"\n' if self.is_trading_day(day) else ''
+            return 'text/csv', body.encode('cp950')
+        if not self.is_trading_day(day):
+            return 'application/json', json.dumps({'stat': '很抱歉，沒有符合條件的資料!'}, ensure_ascii=False).encode()
+        fields = ['證券代號', '證券名稱', '成交股數', '成交筆數', '成交金額', '開盤價', '最高價', '最低價', '收盤價', '漲跌(+/-)', '漲跌價差']
+        rows = []
+        for symbol in self.twse_symbols:
+            q = self.quote(symbol, day)
+            rows.append([symbol, f'上市{symbol}', _number(q['volume']), '100', _number(q['volume'] * q['close']), _number(q['open'], 2),
+                         _number(q['high'], 2), _number(q['low'], 2), _number(q['close'], 2), '+' if q['change'] >= 0 else '-', _number(abs(q['change']), 2)])
+        tables = [{'title': '價格指數', 'fields': ['指數', '收盤指數'], 'data': []}, {'title': '每日收盤行情', 'fields': fields, 'data': rows}]
+        return 'application/json', json.dumps({'stat': 'OK', 'tables': tables}, ensure_ascii=False).encode()
+
+    # stk_quote_result: all TPEx closes of a date
+    def tpex_daily_close(self, query):
+        params = parse_qs(query)
+        taiwan_year, month, day_of_month = (int(part) for part in params.get('d', ['0/0/0'])[0].split('/'))
+        day = date(taiwan_year + 1911, month, day_of_month)
+        fields = ['代號', '名稱', '收盤', '漲跌', '開盤', '最高', '最低', '均價', '成交股數', '成交金額(元)', '成交筆數']
+        rows = []
+        if self.is_trading_day(day):
+            for symbol in self.tpex_symbols:
+                q = self.quote(symbol, day)
+                rows.append([symbol, f'上櫃{symbol}', _number(q['close'], 2), f"{q['change']:+.2f}", _number(q['open'], 2),
+                             _number(q['high'], 2), _number(q['low'], 2), _number(q['close'], 2), _number(q['volume']),
+                             _number(q['volume'] * q['close']), '0'])
+        tables = [{'title': '上櫃股票行情', 'date': _taiwan_date(day), 'fields': fields, 'data': rows, 'totalCount': len(rows)}]
+        return 'application/json', json.dumps({'stat': 'ok', 'reportDate': _taiwan_date(day), 'tables': tables}, ensure_ascii=False).encode()
+
+    def holiday_schedule(self, query):
+        rows = [[day.isoformat(), '休市', '依規定放假'] for day in sorted(self.holidays)]
+        return 'application/json', json.dumps({'stat': 'ok', 'fields': ['日期', '名稱', '說明'], 'data': rows}, ensure_ascii=False).encode()
+
+    def twse_listing(self, query):
+        companies = [{'公司代號': symbol, '公司簡稱': f'上市{symbol}', '產業別': '01'} for symbol in self.twse_symbols]
+        return 'application/json', json.dumps(companies, ensure_ascii=False).encode()
+
+    def tpex_listing(self, query):
+        companies = [{'SecuritiesCompanyCode': symbol, 'CompanyAbbreviation': f'上櫃{symbol}', 'SecuritiesIndustryCode': '02'} for symbol in self.tpex_symbols]
+        return 'application/json', json.dumps(companies, ensure_ascii=False).encode()
+
+    # ISIN code table of a market (strMode 2: TWSE, 4: TPEx), Big5 encoded like the real page
+    def isin_listing(self, query):
+        twse = parse_qs(query).get('strMode') == ['2']
+        symbols, market = (self.twse_symbols, '上市') if twse else (self.tpex_symbols, '上櫃')
+        header = ['有價證券代號及名稱', '國際證券辨識號碼(ISIN Code)', '上市日', '市場別', '產業別', 'CFICode', '備註']
+        rows = [''.join(f'<td>{cell}</td>' for cell in header), '<td colspan=7><B> 股票 <B></td>']
+        rows += [f'<td>{symbol}\u3000{market}{symbol}</td><td>TW000{symbol}000</td><td>2000/01/01</td><td>{market}</td><td>水泥工業</td><td>ESVUFR</td><td></td>'
+                 for symbol in symbols]
+        rows.append('<td colspan=7><B> ETF <B></td>')
+        page = '<html><body><table class="h4">' + ''.join(f'<tr>{row}</tr>' for row in rows) + '</table></body></html>'
+        return 'text/html; charset=MS950', page.encode('cp950')
+
+    def _institutional_rows(self, symbols, day):
+        rows = []
+        for symbol in symbols:
+            foreign = self.foreign_net(symbol, day)
+            trust = foreign // 7
+            dealer = -foreign // 11
+            rows.append((symbol, foreign, trust, dealer))
+        return rows
+
+    # T86 csv of a date, Big5 encoded like the real file
+    def twse_t86(self, query):
+        params = parse_qs(query)
+        day = datetime.strptime(params.get('date', [''])[0], '%Y%m%d').date()
+        if not self.is_trading_day(day):
+            return 'text/csv', b''
+        lines = [f'"{day.year - 1911}年{day.month:02d}月{day.day:02d}日 三大法人買賣超日報"', ','.join(f'"{h}"' for h in T86_HEADER)]
+        for symbol, foreign, trust, dealer in self._institutional_rows(self.twse_symbols, day):
+            values = [f'上市{symbol}', _number(max(foreign, 0)), _number(max(-foreign, 0)), _number(foreign),
+                      '0', '0', '0', _number(max(trust, 0)), _number(max(-trust, 0)), _number(trust),
+                      _number(dealer), '0', '0', _number(dealer), '0', '0', '0', _number(foreign + trust + dealer)]
+            lines.append(f'="{symbol}",' + ','.join(f'"{v}"' for v in values))
+        lines.append('"說明:"')
+        return 'text/csv', ('\n'.join(lines) + '\n').encode('cp950')
+
+    # 3itrade_hedge_result csv, today unless a "d" parameter is given
+    def tpex_3insti(self, query):
+        params = parse_qs(query)
+        day = self.as_of
+        if 'd' in params:
+            taiwan_year, month, day_of_month = (int(part) for part in params['d'][0].split('/'))
+            day = date(taiwan_year + 1911, month, day_of_month)
+        if not self.is_trading_day(day):
+            return 'text/csv', '"共0筆"\n'.encode('cp950')
+        lines = ['"三大法人買賣明細資訊"', f'"資料日期:{_taiwan_date(day)}"', ','.join(f'"{h}"' for h in TPEX_3INSTI_HEADER)]
+        for symbol, foreign, trust, dealer in self._institutional_rows(self.tpex_symbols, day):
+            values = [symbol, f'上櫃{symbol}', _number(max(foreign, 0)), _number(max(-foreign, 0)), _number(foreign), '0', '0', '0',
+                      _number(max(foreign, 0)), _number(max(-foreign, 0)), _number(foreign), _number(max(trust, 0)), _number(max(-trust, 0)), _number(trust),
+                      '0', '0', _number(dealer), '0', '0', '0', '0', '0', _number(dealer), _number(foreign + trust + dealer)]
+            lines.append(','.join(f'"{v}"' for v in values))
+        return 'text/csv', ('\n'.join(lines) + '\n').encode('cp950')
+
+    # goodinfo StockList page for the foreign buying streak screen
+    def goodinfo_stock_list(self, query):
+        headers = ['代號', '名稱', '成交', '漲跌價', '漲跌幅', '外資連續買賣日數', '外資買賣超(張)']
+        rows = []
+        for symbol in self.twse_symbols + self.tpex_symbols:
+            streak = self.foreign_streak(symbol)
+            if streak <= 0:
+                continue
+            q = self.quote(symbol, self.as_of)
+            cells = [symbol, f'股票{symbol}', f"{q['close']:.2f}", f"{q['change']:+.2f}", f"{q['change'] / q['close'] * 100:+.2f}",
+                     str(streak), _number(self.foreign_net(symbol, self.as_of) // 1000)]
+            rows.append('<tr>' + ''.join(f'<td><nobr>{cell}</nobr></td>' for cell in cells) + '</tr>')
+        header_row = '<tr>' + ''.join(f'<th>{header}</th>' for header in headers) + '</tr>'
+        # The real page carries a lot of markup around the table
+        page = ('<html><head><meta charset="utf-8"><title>StockList</title></head><body>'
+                + '<div>' + '<p>filler</p>' * 500 + '</div>'
+                + f'<table id="tblStockList"><thead>{header_row}</thead><tbody>{"".join(rows)}</tbody></table></body></html>')
+        return 'text/html; charset=utf-8', page.encode('utf-8')
+
+    # Map a request path to its handler
+    def handle(self, path, query):
+        routes = {
+            'STOCK_DAY': self.twse_stock_day,
+            'MI_INDEX': self.twse_mi_index,
+            'T86': self.twse_t86,
+            'holidaySchedule': self.holiday_schedule,
+            't187ap03_L': self.twse_listing,
+            'mopsfe_t187ap03_O': self.tpex_listing,
+            'C_public.jsp': self.isin_listing,
+            'st43_result.php': self.tpex_st43,
+            'stk_quote_result.php': self.tpex_daily_close,
+            '3itrade_hedge_result.php': self.tpex_3insti,
+            'StockList.asp': self.goodinfo_stock_list,
+        }
+        endpoint = path.rstrip('/').split('/')[-1]
+        handler = routes.get(endpoint)
+        if handler is None:
+            return None
+
+        # Recorded responses take precedence over synthetic ones
+        recorded = fixture_path(path, query)
+        if os.path.exists(recorded):
+            with open(recorded, 'rb') as file:
+                return 'application/octet-stream', file.read()
+        return handler(query)
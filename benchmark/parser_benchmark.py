@@ -0,0 +1,73 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import goodinfo_parser
+from fixtures import SyntheticMarket
+
+# The extraction of get_stock_list before goodinfo_parser: a full html.parser tree of the page
+def parse_baseline(content):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, 'html.parser')
+    table = soup.find('table', {'id': 'tblStockList'})
+    headers = [header.text.strip() for header in table.find_all('th')]
+    data = []
+    for row in table.find_all('tr')[1:]:
+        data.append([col.text.strip() for col in row.find_all('td')])
+    df = pd.DataFrame(data, columns=headers)
+    return df.drop_duplicates(subset=['代號'])
+
+# Function to time a parser, returns the median and best wall time in milliseconds
+def time_parser(parse, content, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse(content)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), min(timings)
+
+# Usage: parser_benchmark.py [--page saved_StockList.html] [--stocks 2000] [--repeat 20]
+# Without --page a synthetic page is generated, record a real one with record_fixtures.py
+def main():
+    parser = argparse.ArgumentParser(description='Compare the goodinfo StockList table extractors')
+    parser.add_argument('--page', help='saved StockList page (HTML), default a synthetic page')
+    parser.add_argument('--stocks', type=int, default=2000, help='stocks on the synthetic page')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.page:
+        with open(args.page, 'rb') as file:
+            content = file.read()
+    else:
+        content = SyntheticMarket(args.stocks, date.today()).goodinfo_stock_list('')[1]
+
+    candidates = [('baseline (bs4 html.parser)', parse_baseline)]
+    candidates += [(name, lambda content, name=name: goodinfo_parser.parse_stock_table(content, name)) for name in goodinfo_parser.available_parsers()]
+
+    expected = None
+    print(f"page: {len(content) // 1024} KB")
+    print(f"{'parser':<28}{'median ms':>11}{'best ms':>10}{'rows':>7}")
+    for name, parse in candidates:
+        try:
+            table = parse(content)
+        except ImportError as e:
+            print(f"{name:<28}{'skipped: ' + str(e):>28}")
+            continue
+        symbols = table['代號'].tolist()
+        if expected is None:
+            expected = symbols
+        elif symbols != expected:
+            print(f"{name}: rows differ from the baseline")
+        median, best = time_parser(parse, content, args.repeat)
+        print(f"{name:<28}{median:>11.2f}{best:>10.2f}{len(table):>7}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import argparse
+import os
+import sys
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_client
+from fixtures import fixture_path
+
+# Function to download a live response and save it where the replay server looks for recorded fixtures
+def record(url):
+    response = http_client.get(url)
+    response.raise_for_status()
+    parts = urlsplit(url)
+    path = fixture_path(parts.path, parts.query)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(response.content)
+    print(f'{url} -> {os.path.relpath(path)} ({len(response.content)} bytes)')
+
+# Usage: record_fixtures.py <url> [<url> ...], e.g. a STOCK_DAY, st43_result, MI_INDEX, T86, 3itrade_hedge_result or StockList URL
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record live exchange responses as replay fixtures')
+    parser.add_argument('urls', nargs='+')
+    for url in parser.parse_args().urls:
+        record(url)
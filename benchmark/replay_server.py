@@ -0,0 +1,78 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# Local stand-in for TWSE, TPEx, goodinfo and the Discord webhook
+# Requests arrive as http://127.0.0.1:<port>/<original host>/<original path>?<query> (see http_client.REPLAY_URL)
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, market, latency=0.0, port=0):
+        super().__init__(('127.0.0.1', port), ReplayHandler)
+        self.market = market
+        self.latency = latency
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {'requests': 0, 'bytes_sent': 0, 'bytes_received': 0, 'webhook_messages': 0, 'requests_by_host': {}}
+
+    def record(self, host, bytes_sent, bytes_received, webhook=False):
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_sent'] += bytes_sent
+            self.stats['bytes_received'] += bytes_received
+            self.stats['webhook_messages'] += 1 if webhook else 0
+            self.stats['requests_by_host'][host] = self.stats['requests_by_host'].get(host, 0) + 1
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _split(self):
+        parts = urlsplit(self.path)
+        host, _, path = parts.path.lstrip('/').partition('/')
+        return host, '/' + path, parts.query
+
+    def _respond(self, status, content_type, body, host, bytes_received=0, webhook=False):
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.record(host, len(body), bytes_received, webhook)
+
+    def do_GET(self):
+        host, path, query = self._split()
+        response = self.server.market.handle(path, query)
+        if response is None:
+            self._respond(404, 'text/plain', b'not found', host)
+            return
+        content_type, body = response
+        self._respond(200, content_type, body, host)
+
+    # Webhook sink, accepts any upload and answers like Discord
+    def do_POST(self):
+        host, path, query = self._split()
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if '/api/webhooks/' not in path:
+            self._respond(404, 'text/plain', b'not found', host, length)
+            return
+        self._respond(200, 'application/json', json.dumps({'id': '0'}).encode(), host, length, webhook=True)
+
+    def log_message(self, format, *args):
+        pass
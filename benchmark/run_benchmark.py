@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from fixtures import SyntheticMarket
+from replay_server import ReplayServer
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+RUNNER = os.path.join(BENCHMARK_DIR, 'scenario_runner.py')
+
+GET_STOCK_DATA_CODE = '''
+import fetch_scheduler
+import stock_info
+from data_paths import read_properties
+# Apply the benchmark config's request budgets like the reports do, so --unthrottled covers this scenario too
+fetch_scheduler.configure(read_properties())
+for stock_number in {stock_numbers!r}:
+    stock_info.get_stock_data(stock_number, {date_time!r}, 20)
+'''
+
+# Function to pick the last weekday on or before a date as the benchmark's "today"
+def last_weekday(day):
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+# Function to run one scenario in a fresh interpreter, returns wall time and peak RSS of the child
+def run_scenario(args, env, cwd):
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, RUNNER] + args, env=env, cwd=cwd,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall_time = time.perf_counter() - started
+    if process.returncode != 0:
+        sys.stderr.write(stderr.decode(errors='replace')[-2000:])
+    # ru_maxrss is in kilobytes on Linux
+    return wall_time, rusage.ru_maxrss / 1024, process.returncode
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark against a local replay server')
+    parser.add_argument('--stocks', type=int, default=300, help='number of synthetic stocks in both markets')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every replayed response')
+    parser.add_argument('--scenario', action='append', help='scenario to run (repeatable), default all')
+    parser.add_argument('--unthrottled', action='store_true', help='lift the per-host request budgets')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    as_of = last_weekday(date.today() - timedelta(days=1))
+    market = SyntheticMarket(args.stocks, as_of, holidays=[date(as_of.year, 1, 1)])
+    server = ReplayServer(market, latency=args.latency).start()
+
+    work_dir = tempfile.mkdtemp(prefix='twsr-bench-')
+    data_dir = os.path.join(work_dir, 'data')
+    config_path = os.path.join(work_dir, 'config.json')
+    with open(os.path.join(REPO_DIR, 'config.json'), 'r') as file:
+        properties = json.load(file)
+    properties['discord_webhook_url'] = 'https://discord.com/api/webhooks/0/benchmark'
+    if args.unthrottled:
+        properties['rate_limits'] = {host: {'rate': 1000, 'burst': 1000} for host in ('twse.com.tw', 'tpex.org.tw', 'goodinfo.tw')}
+    with open(config_path, 'w') as file:
+        json.dump(properties, file)
+
+    env = dict(os.environ,
+               TWSR_REPLAY_URL=server.url,
+               TWSR_DATA_DIR=data_dir,
+               TWSR_CONFIG=config_path,
+               TWSR_BENCH_NOW=datetime.combine(as_of, datetime.min.time()).replace(hour=17).isoformat())
+
+    stock_numbers = market.twse_symbols[:3] + market.tpex_symbols[:3]
+    scenarios = {
+        # Cold caches: empty data directory
+        'screener_cold': ['script', os.path.join(REPO_DIR, 'daily_stock_report.py')],
+        # Warm caches: reuses the data directory left by screener_cold
+        'screener_warm': ['script', os.path.join(REPO_DIR, 'daily_stock_report.py')],
+        '3insti': ['script', os.path.join(REPO_DIR, 'daily_3insti_report.py')],
+        'get_stock_data': ['code', GET_STOCK_DATA_CODE.format(stock_numbers=stock_numbers, date_time=as_of.strftime('%Y%m%d'))],
+    }
+
+    results = []
+    for name in args.scenario or list(scenarios):
+        if name == 'screener_cold':
+            shutil.rmtree(data_dir, ignore_errors=True)
+        server.reset_stats()
+        wall_time, peak_rss_mb, returncode = run_scenario(scenarios[name], env, work_dir)
+        stats = dict(server.stats)
+        results.append({
+            'scenario': name,
+            'wall_time_s': round(wall_time, 2),
+            'requests': stats['requests'],
+            'bytes_sent': stats['bytes_sent'],
+            'bytes_received': stats['bytes_received'],
+            'webhook_messages': stats['webhook_messages'],
+            'peak_rss_mb': round(peak_rss_mb, 1),
+            'exit_code': returncode,
+            'requests_by_host': stats['requests_by_host'],
+        })
+
+    server.shutdown()
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"{'scenario':<16}{'wall s':>9}{'requests':>10}{'KB down':>10}{'KB up':>9}{'webhook':>9}{'RSS MB':>9}")
+    for result in results:
+        print(f"{result['scenario']:<16}{result['wall_time_s']:>9}{result['requests']:>10}{result['bytes_sent'] // 1024:>10}"
+              f"{result['bytes_received'] // 1024:>9}{result['webhook_messages']:>9}{result['peak_rss_mb']:>9}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'as_of': as_of.isoformat(), 'stocks': args.stocks, 'latency': args.latency, 'results': results}, file, indent=4)
+
+if __name__ == '__main__':
+    main()
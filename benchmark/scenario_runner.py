@@ -0,0 +1,33 @@
+import datetime as _datetime
+import os
+import runpy
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The scripts read the clock through datetime.now(), freeze it at TWSR_BENCH_NOW so fixtures line up with "today"
+class FrozenDatetime(_datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls.fromisoformat(os.environ['TWSR_BENCH_NOW'])
+
+    @classmethod
+    def today(cls):
+        return cls.now()
+
+# Usage: scenario_runner.py script <path> [args...] | scenario_runner.py code <python source>
+if __name__ == '__main__':
+    if 'TWSR_BENCH_NOW' in os.environ:
+        # numpy and pandas check the size of datetime.datetime when their compiled extensions load,
+        # import them with the real class so only the scripts' later "from datetime import datetime" see the frozen one
+        import numpy
+        import pandas
+        _datetime.datetime = FrozenDatetime
+    sys.path.insert(0, REPO_DIR)
+
+    mode, target = sys.argv[1], sys.argv[2]
+    if mode == 'script':
+        sys.argv = [target] + sys.argv[3:]
+        runpy.run_path(target, run_name='__main__')
+    else:
+        exec(compile(target, '<scenario>', 'exec'), {'__name__': '__main__'})
@@ -0,0 +1,90 @@
+import argparse
+import signal
+import threading
+from datetime import datetime, timedelta
+
+import daily_3insti_report
+import daily_stock_report
+import trading_calendar
+from data_paths import read_properties
+from logger_config import setup_logger
+
+# Set up the logger
+logger = setup_logger()
+
+# Weekday start times (HH:MM) of the jobs, "schedule" in config.json overrides them
+DEFAULT_SCHEDULE = {
+    'daily_3insti_report': '16:15',
+    'daily_stock_report': '17:00',
+}
+
+# Jobs by name, each runs one report in this process
+JOBS = {
+    'daily_3insti_report': daily_3insti_report.main,
+    'daily_stock_report': lambda: daily_stock_report.main([]),
+}
+
+_stop = threading.Event()
+
+# Function to get the next weekday start time of a job after now
+def next_run_time(start_time, now):
+    hour, minute = (int(part) for part in start_time.split(':'))
+    run_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run_time <= now:
+        run_time += timedelta(days=1)
+    while run_time.weekday() >= 5:
+        run_time += timedelta(days=1)
+    return run_time
+
+# Function to run one job, a failing job is logged and doesn't stop the daemon
+def run_job(name):
+    logger.info(f"Running job: {name}")
+    # Calendars built without the holiday schedule are downloaded again
+    trading_calendar.refresh()
+    try:
+        JOBS[name]()
+    except Exception:
+        logger.exception(f"Job failed: {name}")
+
+# Function to run the jobs on schedule until SIGTERM or SIGINT
+# Connection pools, the stock listing, trading calendars and imported modules stay warm between runs
+def serve(schedule):
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda *_: _stop.set())
+
+    next_runs = {name: next_run_time(start_time, datetime.now()) for name, start_time in schedule.items()}
+    while not _stop.is_set():
+        name = min(next_runs, key=next_runs.get)
+        logger.info(f"Next job: {name} at {next_runs[name].strftime('%Y-%m-%d %H:%M')}")
+
+        # Sleep in short steps so a changed wall clock (e.g. after suspend) is noticed
+        while not _stop.is_set() and datetime.now() < next_runs[name]:
+            _stop.wait(min(60, max(0, (next_runs[name] - datetime.now()).total_seconds())))
+        if _stop.is_set():
+            break
+
+        run_job(name)
+        next_runs[name] = next_run_time(schedule[name], datetime.now())
+    logger.info("Daemon stopped.")
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the daily reports on schedule in one long-running process')
+    parser.add_argument('--once', choices=sorted(JOBS), help='run one job right away and exit')
+    args = parser.parse_args()
+
+    if args.once:
+        run_job(args.once)
+        return
+
+    # Same config as the reports
+    properties = read_properties()
+    schedule = dict(DEFAULT_SCHEDULE, **properties.get('schedule', {}))
+    unknown = set(schedule) - set(JOBS)
+    if unknown:
+        raise ValueError(f"Unknown job in schedule: {', '.join(sorted(unknown))}")
+
+    logger.info("Starting daemon: " + ', '.join(f'{name} at {start_time}' for name, start_time in schedule.items()))
+    serve(schedule)
+
+if __name__ == '__main__':
+    main()
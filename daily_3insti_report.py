@@ -1,64 +1,82 @@
-import os
-import requests
-import json
 from datetime import datetime
-from discord_webhook import DiscordWebhook, DiscordEmbed
 
-from logger_config import setup_logger
+import discord_delivery
+import fetch_scheduler
+import http_cache
+import institutional_store
+import memory_budget
+import metrics
+import trading_calendar
+from data_paths import read_properties
+from logger_config import DEFAULT_DEBUG_SAMPLE, set_debug_sample, setup_logger
 
 # Set up the logger
 logger = setup_logger()
 
-# Function to check if today is a trading day
-def is_trading_day():
-    today_date = datetime.now().strftime("%Y%m%d")
-    url = f"https://www.twse.com.tw/rwd/zh/afterTrading/MI_INDEX?date={today_date}&type=MS&response=csv"
-    response = requests.get(url)
-    return bool(response.text.strip())  # If the response is empty, it's not a trading day
-
-# Function to read properties from a JSON file
-def read_properties(file_path):
-    with open(file_path, 'r') as file:
-        properties = json.load(file)
-    return properties
+# Charsets published by the exchanges, CSVs in them are forwarded byte for byte
+BIG5_CHARSETS = ('big5', 'cp950', 'ms950', 'big5-hkscs')
 
-# Function to fetch CSV data from the given URL
+# Function to fetch CSV data from the given URL, returns the Big5 bytes
+# Both exchanges publish Big5 CSVs, only a file declared in another charset is transcoded
 def fetch_csv_data(url):
-    response = requests.get(url)
-    return response.text
-
-# Function to send CSV data as a file and message to Discord webhook
-def send_to_discord_webhook(webhook_url, csv_data, filename, message):
-    # Encode CSV data to Big5
-    csv_data_big5 = csv_data.encode('big5', errors='ignore')
+    response = http_cache.get(url)
+    response.raise_for_status()
+    charset = response.headers.get('Content-Type', '').partition('charset=')[2].strip().strip('"').lower()
+    if charset and charset not in BIG5_CHARSETS:
+        return response.content.decode(charset, errors='replace').encode('big5', errors='ignore')
+    return response.content
+
+# Function to download one exchange's CSV and upload it as soon as it arrives, returns True on success
+def fetch_and_send(market, url, webhook_url, filename, message):
+    try:
+        with metrics.phase(f'fetch_{market.lower()}'):
+            csv_data = fetch_csv_data(url)
+        # The URL carries today's date, a file without records means today's isn't published (or the market was closed)
+        if not institutional_store.has_records(csv_data):
+            logger.error(f"({market}) No institutional flows for today yet, nothing sent")
+            return False
+        # Keep the flows for the foreign buying streaks of the stock report, parsed from the same bytes as the upload
+        # Storing is independent of the upload: a file the parser doesn't understand is still sent
+        try:
+            if not institutional_store.save_csv(market, datetime.now(), csv_data):
+                logger.error(f"({market}) Institutional flows not stored, the CSV couldn't be parsed")
+        except Exception as e:
+            logger.error(f"({market}) Fail to store institutional flows: {e}")
+        # Sent right away through the outbox, a failed upload is retried by a later run
+        with metrics.phase('discord_upload'):
+            return discord_delivery.deliver(webhook_url, message, [(filename, csv_data)])
+    except Exception as e:
+        logger.error(f"({market}) Error: {e}")
+        return False
 
-    webhook = DiscordWebhook(url=webhook_url, content=message)
-    webhook.add_file(file=csv_data_big5, filename=filename)
-    webhook.execute()
+# Function to run the report once
+def main():
+    # Every run reports its own metrics, the daemon runs this repeatedly in one process
+    metrics.reset()
 
-if __name__ == "__main__":
     try:
-        # Check if today is a trading day
-        if not is_trading_day():
+        # Check if today is a trading day, an unscheduled closure shows as dated files without records
+        if not trading_calendar.is_trading_day():
             logger.info("Today is not a trading day. Skipping main process.")
-            exit()
+            return
     except Exception as e:
         logger.error(f"Error: {e}")
-        exit()
+        return
 
-    # Find the path of the current script
-    script_path = os.path.dirname(os.path.abspath(__file__))
-    # Construct the path to config.json
-    config_path = os.path.join(script_path, 'config.json')
     # Read the properties file
-    properties = read_properties(config_path)
+    properties = read_properties()
+    discord_delivery.configure(properties)
+    set_debug_sample(properties.get('log_debug_sample', DEFAULT_DEBUG_SAMPLE))
+    http_cache.configure(properties)
+    memory_budget.configure(properties)
 
     # Get today's date in the format YYYYMMDD
     today_date = datetime.now().strftime("%Y%m%d")
 
-    # Replace this URL with the actual URL you want to fetch data from
-    twse_3insti_url = f"https://www.twse.com.tw/rwd/zh/fund/T86?date={today_date}&selectType=ALL&response=csv"
-    tpex_3insti_url = "https://www.tpex.org.tw/web/stock/3insti/daily_trade/3itrade_hedge_result.php?l=zh-tw&o=csv&se=EW&t=D"
+    # Both URLs carry today's date, TPEx's undated URL returns the latest published file, possibly yesterday's
+    # The same files as the stock report's streaks, without warrants (TPEx's se=EW never had them), so its download is a cache hit
+    twse_3insti_url = institutional_store.get_csv_url('TWSE', datetime.now())
+    tpex_3insti_url = institutional_store.get_csv_url('TPEX', datetime.now())
 
     try:
         # Read Discord webhook URL from config.json
@@ -67,20 +85,28 @@ if __name__ == "__main__":
         if not discord_webhook_url:
             raise ValueError("Discord webhook URL not found in config.json")
 
-         # Get today's date in the format YYYYMMDD
+        # Get today's date in the format YYYYMMDD
         today_date_readable = datetime.now().strftime("%Y年%m月%d日")
 
-        # Fetch TWSE data
-        twse_csv_data = fetch_csv_data(twse_3insti_url)
-        # Send TWSE data to Discord webhook
-        send_to_discord_webhook(discord_webhook_url, twse_csv_data, f"twse_3insti_{today_date}.csv", f"{today_date_readable} 證交所-三大法人買賣超日報")
+        # Both exchanges are downloaded concurrently, each file is uploaded as soon as it arrives
+        reports = [
+            ('TWSE', twse_3insti_url, f"twse_3insti_{today_date}.csv", f"{today_date_readable} 證交所-三大法人買賣超日報"),
+            ('TPEX', tpex_3insti_url, f"tpex_3insti_{today_date}.csv", f"{today_date_readable} 櫃買中心-三大法人買賣超日報"),
+        ]
+        results = fetch_scheduler.map_concurrently(lambda report: fetch_and_send(report[0], report[1], discord_webhook_url, report[2], report[3]), reports, max_workers=len(reports))
 
-        # Fetch TPEX data
-        tpex_csv_data = fetch_csv_data(tpex_3insti_url)
-        # Send TPEX data to Discord webhook
-        send_to_discord_webhook(discord_webhook_url, tpex_csv_data, f"tpex_3insti_{today_date}.csv", f"{today_date_readable} 櫃買中心-三大法人買賣超日報")
+        if all(results):
+            logger.info("CSV data sent to Discord successfully!")
+        memory_budget.check('3insti_upload')
 
-        logger.info("CSV data sent to Discord successfully!")
+        # Retry reports left in the outbox by earlier runs
+        discord_delivery.flush()
 
     except Exception as e:
         logger.error(f"Error: {e}")
+
+    # Export the run summary and Prometheus textfile
+    metrics.export('daily_3insti_report', properties)
+
+if __name__ == "__main__":
+    main()
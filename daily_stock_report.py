@@ -1,143 +1,322 @@
-import requests, json, os
-from bs4 import BeautifulSoup
+import argparse
 import pandas as pd
-import time
-import random
 from datetime import datetime
-from stock_info import get_stock_data_today, StockPriceDifference
+import discord_delivery
+import fetch_scheduler
+import goodinfo_parser
+import http_cache
+import institutional_store
+import memory_budget
+import metrics
+import result_index
+import run_journal
+import screens
+import trading_calendar
+from data_paths import read_properties
+from stock_info import build_quote_matrices, get_daily_quotes, get_lookback_history
+from momentum import append_quote, compute_features, feature_columns, histories_to_matrices, slim_history
 
-from logger_config import setup_logger
+from logger_config import DEFAULT_DEBUG_SAMPLE, set_debug_sample, setup_logger
 
 # Set up the logger
 logger = setup_logger()
 
-# Function to check if today is a trading day
-def is_trading_day():
-    today_date = datetime.now().strftime("%Y%m%d")
-    url = f"https://www.twse.com.tw/rwd/zh/afterTrading/MI_INDEX?date={today_date}&type=MS&response=csv"
-    response = requests.get(url)
-    return bool(response.text.strip())  # If the response is empty, it's not a trading day
+# Column of goodinfo's stock list holding the close
+GOODINFO_CLOSE_COLUMN = '成交'
 
-# Function to read properties from a JSON file
-def read_properties(file_path):
-    with open(file_path, 'r') as file:
-        properties = json.load(file)
-    return properties
+# Function to check today's all-market quotes before screening, the calendar only knows scheduled holidays
+# No quotes in either market reveal a closure such as a typhoon day. The quotes are stored and reused by the screen,
+# so the check costs no extra request. Today's closure is not written to the calendar from a single empty response,
+# build_quote_matrices marks the day once it is past. A failed request trusts the calendar.
+def is_market_open(today):
+    quotes = get_daily_quotes(today)
+    return quotes is None or bool(quotes)
+
+# Function to build the stock list from the local institutional flow store
+# Same columns as the goodinfo list for the screens and the report, only stocks on a foreign buying streak
+def get_local_stock_list():
+    table = institutional_store.get_streak_table(datetime.now())
+    if table is None:
+        return None
+
+    table = table[table['foreign_streak'] > 0].sort_values('foreign_streak', ascending=False)
+    return pd.DataFrame({
+        '代號': table['stock_number'],
+        '名稱': table['name'],
+        '市場': table['market'],
+        '外資連續買賣日數': table['foreign_streak'],
+        '外資買賣超(張)': table['foreign'] // 1000,
+        '投信買賣超(張)': table['trust'] // 1000,
+        '自營商買賣超(張)': table['dealer'] // 1000,
+    }).reset_index(drop=True)
 
 # Function to get stock data from the website
-def get_stock_list():
+# parser picks the HTML backend of goodinfo_parser ("auto", "lxml", "selectolax" or "bs4")
+def get_stock_list(parser='auto'):
     url = "https://goodinfo.tw/tw2/StockList.asp?RPT_TIME=&MARKET_CAT=智慧選股&INDUSTRY_CAT=外資連買+–+日%40%40外資連續買超%40%40外資連續買超+–+日"
 
     requestHeaders = {
         'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36'
     }
 
-    response = requests.get(url, headers = requestHeaders)
-    response.encoding = 'utf-8'
-    # Parse the HTML content of the page
-    soup = BeautifulSoup(response.content, 'html.parser')
-
-    # Find the table containing the stock data
-    table = soup.find('table', {'id': 'tblStockList'})
-    headers = [header.text.strip() for header in table.find_all('th')]
-    data = []
-
-    for row in table.find_all('tr')[1:]:
-        columns = [col.text.strip() for col in row.find_all('td')]
-        data.append(columns)
-
-    df = pd.DataFrame(data, columns=headers)
-    # Deduplicate the DataFrame based on all columns
-    df_deduped_stock_list = df.drop_duplicates(subset=['代號'])
-    return df_deduped_stock_list
-
-# Apply the filtering function to the DataFrame with a random delay
-def filter_stock_data(row):
-    # Introduce a random delay between 3 and 7 seconds
-    delay_seconds = random.uniform(3, 7)
-    time.sleep(delay_seconds)
-
-    stock_number = row['代號']
-    n_records = 9  # Default value
-    desired_min_percent = -20.0  # Default value
-    desired_max_percent = 5.0  # Default value
-
-    # Call get_stock_data_today function
-    stock_data = get_stock_data_today(stock_number, n_records)
-
-    if stock_data is None:
-        logger.info(f"No stock data for: {stock_number}")
-        return False # Remove the record
-    
-    if stock_data.percentage_difference is None:
-        logger.info(f"stock_data.percentage_difference is none: {stock_number}")
-        return False  # Remove the record
-
-    # Check if percentage_difference is within the desired range
-    if not (desired_min_percent <= stock_data.percentage_difference <= desired_max_percent):
-        logger.info(f"stock_data.percentage_difference is not in range: {stock_number}")
-        return False # Remove the record
-
-    return True
-
-
-try:
-    # Check if today is a trading day
-    if not is_trading_day():
-        logger.info("Today is not a trading day. Skipping main process.")
-        exit()
-except Exception as e:
-    logger.error(f"Error: {e}")
-    exit()
-
-logger.info("Starting stock report process...")
-
-# Find the path of the current script
-script_path = os.path.dirname(os.path.abspath(__file__))
-# Construct the path to config.json
-config_path = os.path.join(script_path, 'config.json')
-# Read the properties file
-properties = read_properties(config_path)
-
-# Get initial stock data
-stock_list = get_stock_list()
-
-# Check if the table is found
-if stock_list is not None:
-    # Read min_cont_buy_days from the properties file with a default value of 5
-    min_cont_buy_days = properties.get('min_cont_buy_days', 5)
-    discord_webhook_url = properties.get('discord_webhook_url', '')
-
-    # Convert the column to numeric for comparison
-    stock_list['外資連續買賣日數'] = pd.to_numeric(stock_list['外資連續買賣日數'], errors='coerce')
-
-    # Filter DataFrame records where "外資連續買賣日數" is smaller than min_cont_buy_days
-    df_day_filtered = stock_list[stock_list['外資連續買賣日數'] >= min_cont_buy_days]
-
-    # Apply the filtering function to the DataFrame
-    hp_stock_data = df_day_filtered[df_day_filtered.apply(filter_stock_data, axis=1)]
-
-    # Save the filtered DataFrame to a CSV file with "big5" encoding
-    hp_stock_data.to_csv('hp_stock_data.csv', index=False, encoding='big5', errors='replace')
-
-    # Create a message for the Discord webhook
-    message = f"外資連續{min_cont_buy_days}日以上買超, 10日漲跌幅區間:-20% ~ 5%"
-
-    # Create a file object from the CSV file
-    file = {'file': ('hp_stock_data.csv', open('hp_stock_data.csv', 'rb'))}
-
-    # Include the message in the Discord webhook request
-    payload = {
-        'content': message
-    }
+    # Only the stock table is extracted, deduplicated by symbol, and an unchanged page isn't downloaded or parsed again
+    return goodinfo_parser.fetch_stock_table(url, requestHeaders, parser)
+
+# Function to get the price history of one candidate, journaled as soon as it is fetched
+# Only the float32 close and volume are kept, the rest of the month pages is released right away
+def get_journaled_history(stock_number, today_date, n_records):
+    history = slim_history(get_lookback_history(stock_number, today_date, n_records))
+    run_journal.save_history(today_date, stock_number, history)
+    return history
+
+# Function to split the candidates by what changed since the result index last saw them, using today's all-market quotes
+# Returns (features reused from today's evaluations, {stock_number: history extended by today's quote}, stocks to fetch)
+def get_incremental_inputs(stock_numbers, today, windows):
+    today_date = today.strftime('%Y%m%d')
+    quotes = get_daily_quotes(today)
+    if not quotes:
+        # Today's quotes aren't published yet, every candidate is fetched
+        return pd.DataFrame(columns=feature_columns(windows)), {}, stock_numbers
+
+    # Evaluated today with the same close (and windows): nothing changed, keep the features
+    evaluated = result_index.load_evaluations(today_date)
+    unchanged = []
+    if set(feature_columns(windows)) <= set(evaluated.columns):
+        unchanged = [stock_number for stock_number in stock_numbers if stock_number in evaluated.index and stock_number in quotes
+                     and quotes[stock_number][0] is not None and round(evaluated.at[stock_number, 'close'], 2) == round(quotes[stock_number][0], 2)]
+    reused = evaluated.loc[unchanged, feature_columns(windows)] if unchanged else pd.DataFrame(columns=feature_columns(windows))
+
+    # Indexed as of the previous trading day: carried over from yesterday's list, only today's quote is new
+    previous_days = trading_calendar.previous_trading_days(today, 1)
+    previous_date = previous_days[0].strftime('%Y%m%d') if previous_days else None
+    extended = {}
+    for stock_number, (as_of, history) in result_index.load_histories([s for s in stock_numbers if s not in reused.index]).items():
+        quote = quotes.get(stock_number)
+        if as_of == previous_date and quote is not None and quote[0] is not None:
+            extended[stock_number] = append_quote(history, today, quote[0], quote[1], max(windows))
+            run_journal.save_history(today_date, stock_number, extended[stock_number])
+
+    remaining = [stock_number for stock_number in stock_numbers if stock_number not in reused.index and stock_number not in extended]
+    return reused, extended, remaining
+
+# Function to compute the feature table of all candidates from a single history fetch per stock (or the all-market snapshots)
+# In per_stock mode only new streak entries and stocks with a gap are fetched, see get_incremental_inputs
+def get_features(stock_numbers, windows, quote_matrices=None):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    reused = pd.DataFrame(columns=feature_columns(windows))
+    if not stock_numbers:
+        logger.info("No candidates to evaluate.")
+        return reused
+
+    if quote_matrices is not None:
+        close_matrix, volume_matrix = quote_matrices
+        close_matrix = close_matrix.reindex(columns=stock_numbers)
+        volume_matrix = volume_matrix.reindex(columns=stock_numbers)
+        # Without a record for today every feature would describe an earlier day
+        if not close_matrix.empty and close_matrix.index[-1] != today:
+            close_matrix, volume_matrix = close_matrix.iloc[0:0], volume_matrix.iloc[0:0]
+    else:
+        # Candidates already fetched by an interrupted run of the same trade date are not fetched again
+        today_date = today.strftime('%Y%m%d')
+        histories = {stock_number: slim_history(history) for stock_number, history in run_journal.load_histories(today_date).items()}
+        remaining = [stock_number for stock_number in stock_numbers if stock_number not in histories]
+        if len(remaining) < len(stock_numbers):
+            logger.info(f"Resuming with {len(stock_numbers) - len(remaining)} journaled stocks, {len(remaining)} remaining")
+
+        if remaining:
+            reused, extended, remaining = get_incremental_inputs(remaining, today, windows)
+            histories.update(extended)
+            logger.info(f"{len(reused)} stocks unchanged, {len(extended)} extended by today's quotes, {len(remaining)} histories to fetch")
+
+        # Fetch the histories concurrently in chunks, requests are throttled per host by the fetch scheduler
+        # Memory is checked after every chunk, over the budget the remaining chunks run on a single worker
+        max_workers = None
+        chunk_size = memory_budget.get_chunk_size()
+        for start in range(0, len(remaining), chunk_size):
+            chunk = remaining[start:start + chunk_size]
+            fetched = fetch_scheduler.map_concurrently(lambda stock_number: get_journaled_history(stock_number, today_date, max(windows)), chunk, max_workers)
+            histories.update(zip(chunk, fetched))
+            if not memory_budget.check('fetch_histories'):
+                max_workers = 1
+
+        # Index the histories that reach today, tomorrow they only need tomorrow's quote
+        result_index.save_histories(today_date, {stock_number: history for stock_number, history in histories.items()
+                                                 if history is not None and not history.empty and history.index[-1] == today})
+        evaluated = [stock_number for stock_number in stock_numbers if stock_number not in reused.index]
+        # Histories without a record for today are left out, their features would describe an earlier day
+        close_matrix, volume_matrix = histories_to_matrices({stock_number: histories.get(stock_number) for stock_number in evaluated}, today)
+
+    if close_matrix.columns.empty and not reused.empty:
+        # Every candidate is unchanged since today's last evaluation
+        return reused
+
+    if close_matrix.empty:
+        logger.error("No closing prices for today.")
+
+    features = compute_features(close_matrix, volume_matrix, windows)
+    return pd.concat([features, reused]) if not reused.empty else features
+
+# Function to evaluate every screen over the shared candidate table in one pass
+# Returns the candidates joined with their features and {screen name: boolean mask}
+# The features and every screen's result set are kept in the result index for the day-over-day changes
+def screen_stocks(df, screen_list, windows, quote_matrices=None):
+    stock_numbers = df['代號'].tolist()
+    features = get_features(stock_numbers, windows, quote_matrices).reindex(stock_numbers)
+
+    # Attach the features to the report, rules may use every feature including the close
+    candidates = df.copy()
+    candidates[list(features.columns)] = features.to_numpy()
+
+    masks = screens.evaluate(candidates, screen_list)
+    # goodinfo's list already shows the close as 成交, the local list only has the feature's
+    if GOODINFO_CLOSE_COLUMN in candidates.columns:
+        candidates = candidates.drop(columns=['close'])
+    trade_date = datetime.now().strftime('%Y%m%d')
+    result_index.save_evaluations(trade_date, features.dropna(subset=['close']), dict(zip(stock_numbers, df[screens.CONT_BUY_DAYS_COLUMN])))
+    for screen in screen_list:
+        mask = masks[screen['name']]
+        logger.info(f"Screen {screen['name']}: {int(mask.sum())} of {len(stock_numbers)} stocks passed")
 
-    # Make a POST request to the Discord webhook with the file and message attached
-    response_discord = requests.post(discord_webhook_url, data=payload, files=file)
+    missing = features.index[features['close'].isna()].tolist()
+    if missing:
+        logger.info(f"No price data for: {', '.join(missing)}")
+    return candidates, masks
 
-    # Check if the Discord webhook request was successful
-    if response_discord.status_code == 200:
-        logger.info("Deduplicated and filtered data sent to Discord webhook successfully.")
+# Function to add the report of one screen to the Discord outbox, returns the outbox id
+# With deltas (result_index.get_deltas) the message lists the entered and exited stocks and the CSV marks each row
+# 新進 (entered) or 持續 (unchanged); a list identical to the previous one is not attached again
+def queue_report(screen, report, discord_webhook_url, deltas=None):
+    message = screens.describe(screen)
+    if deltas is not None:
+        message += '\n' + screens.describe_deltas(deltas)
+        if not deltas['entered'] and not deltas['exited']:
+            return discord_delivery.enqueue(discord_webhook_url, message)
+        entered = set(deltas['entered'])
+        report = report.assign(異動=['新進' if stock_number in entered else '持續' for stock_number in report['代號']])
+
+    # The screen's rows are serialized to "big5" CSV in memory
+    attachment = discord_delivery.dataframe_attachment(report, f"{screen['name']}.csv")
+    return discord_delivery.enqueue(discord_webhook_url, message, [attachment])
+
+# Function to run the report once, argv defaults to the command line
+def main(argv=None):
+    # Every run reports its own metrics, the daemon runs this repeatedly in one process
+    metrics.reset()
+
+    parser = argparse.ArgumentParser(description='Foreign buying streak screener')
+    parser.add_argument('--resume', action='store_true', help="continue today's interrupted run from the run journal")
+    args = parser.parse_args(argv)
+
+    try:
+        # Check if today is a trading day
+        if not trading_calendar.is_trading_day():
+            logger.info("Today is not a trading day. Skipping main process.")
+            return
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        return
+
+    logger.info("Starting stock report process...")
+
+    # Read the properties file
+    properties = read_properties()
+    # Apply the per-host request budgets and worker count
+    fetch_scheduler.configure(properties)
+    discord_delivery.configure(properties)
+    set_debug_sample(properties.get('log_debug_sample', DEFAULT_DEBUG_SAMPLE))
+    http_cache.configure(properties)
+    memory_budget.configure(properties)
+
+    if not is_market_open(datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)):
+        logger.info("No quotes published for today, the market looks closed. Skipping main process.")
+        metrics.export('daily_stock_report', properties)
+        return
+
+    # Start a fresh journal for today unless resuming an interrupted run
+    trade_date = datetime.now().strftime('%Y%m%d')
+    stock_list = None
+    if args.resume and run_journal.is_completed(trade_date):
+        # Every report of today was delivered, only reports left in the outbox by other runs are retried
+        logger.info("Today's run already completed, nothing to resume.")
+        discord_delivery.flush()
+        metrics.export('daily_stock_report', properties)
+        return
+    if args.resume:
+        stock_list = run_journal.load_candidates(trade_date)
+        if stock_list is not None:
+            logger.info("Resuming with the journaled stock list.")
+    else:
+        run_journal.reset(trade_date)
+
+    # Get initial stock data
+    if stock_list is None:
+        # "local" computes the streaks from the exchanges' institutional CSVs, "goodinfo" scrapes goodinfo's list
+        with metrics.phase('get_stock_list'):
+            if properties.get('stock_list_source', 'local') == 'goodinfo':
+                stock_list = get_stock_list(properties.get('html_parser', 'auto'))
+            else:
+                stock_list = get_local_stock_list()
+        if stock_list is not None:
+            run_journal.save_candidates(trade_date, stock_list)
+        memory_budget.check('get_stock_list')
+
+    # Check if the table is found
+    if stock_list is not None:
+        discord_webhook_url = properties.get('discord_webhook_url', '')
+        # Screens declared in config.json, the legacy min_cont_buy_days report when there are none
+        screen_list = screens.load_screens(properties)
+        windows = screens.get_feature_windows(screen_list)
+
+        # Convert the column to numeric for comparison
+        stock_list['外資連續買賣日數'] = pd.to_numeric(stock_list['外資連續買賣日數'], errors='coerce')
+
+        # The union of all screens' candidates is fetched once
+        df_day_filtered = stock_list[stock_list['外資連續買賣日數'] >= screens.get_min_cont_buy_days(screen_list)]
+
+        # "snapshot" pulls all-market quotes once per trading day, "per_stock" requests each candidate's history
+        price_mode = properties.get('price_mode', 'snapshot')
+        quote_matrices = None
+        if price_mode == 'snapshot' and not df_day_filtered.empty:
+            with metrics.phase('build_quote_matrices'):
+                quote_matrices = build_quote_matrices(datetime.now().strftime('%Y%m%d'), max(windows) + 1)
+            memory_budget.check('build_quote_matrices')
+
+        # Evaluate every screen over the shared DataFrame
+        with metrics.phase('screen_stocks'):
+            candidates, masks = screen_stocks(df_day_filtered, screen_list, windows, quote_matrices)
+        # The reports only need the candidates, release the matrices before they are serialized
+        quote_matrices = None
+        memory_budget.check('screen_stocks')
+
+        # One report per screen, screens queued before an interruption are not queued again
+        # The outbox owns a queued report until Discord accepts it, reports left over by earlier runs go out in the same flush
+        queued = run_journal.load_queued(trade_date)
+        outbox_ids = set()
+        for screen in screen_list:
+            if screen['name'] in queued:
+                logger.info(f"Screen {screen['name']} already queued today.")
+                continue
+            report = candidates[masks[screen['name']]]
+            # Entered, exited and unchanged stocks since the screen's previous result set, "delta_reports": false sends the full list only
+            deltas = result_index.get_deltas(trade_date, screen['name'], report['代號'].tolist()) if properties.get('delta_reports', True) else None
+            result_index.save_result_set(trade_date, screen['name'], report['代號'].tolist())
+            outbox_ids.add(queue_report(screen, report, discord_webhook_url, deltas))
+            run_journal.mark_queued(trade_date, screen['name'])
+
+        # All reports are batched into as few webhook calls as possible
+        with metrics.phase('discord_upload'):
+            delivered = discord_delivery.flush()
+
+        if outbox_ids <= delivered:
+            logger.info("Screen reports sent to Discord webhook successfully.")
+            run_journal.mark_completed(trade_date)
+        else:
+            logger.error(f"{len(outbox_ids - delivered)} screen reports left in the Discord outbox for the next run.")
     else:
-        logger.error(f"Failed to send deduplicated and filtered data to Discord webhook. Status Code: {response_discord.status_code}")
-else:
-    logger.error("Table not found on the page.")
+        logger.error("Stock list not available.")
+
+    # Export the run summary and Prometheus textfile
+    metrics.export('daily_stock_report', properties)
+
+if __name__ == '__main__':
+    main()
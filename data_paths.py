@@ -0,0 +1,20 @@
+import json
+import os
+
+# Directory holding local caches and stores, next to the scripts by default
+DATA_DIR = os.environ.get('TWSR_DATA_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Function to get the path of config.json next to the scripts, TWSR_CONFIG points to another file (used by the benchmark)
+def get_config_path():
+    return os.environ.get('TWSR_CONFIG') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+
+# Function to read properties from a JSON file, config.json (see get_config_path) by default
+def read_properties(file_path=None):
+    with open(file_path or get_config_path(), 'r') as file:
+        properties = json.load(file)
+    return properties
+
+# Function to resolve a file inside the data directory, creating the directory on first use
+def get_data_path(filename):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, filename)
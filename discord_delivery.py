@@ -0,0 +1,239 @@
+import gzip
+import io
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import http_client
+from data_paths import get_data_path
+from logger_config import setup_logger
+
+# Set up the logger
+logger = setup_logger()
+
+DB_FILENAME = 'discord_outbox.db'
+
+# Discord accepts up to 10 files and 2000 characters of content per message
+MAX_FILES_PER_MESSAGE = 10
+MAX_CONTENT_LENGTH = 2000
+
+# Attachments larger than this many bytes are sent gzip compressed
+DEFAULT_COMPRESS_BYTES = 1024 * 1024
+
+# Times a 429 response is waited out before the message is left in the outbox for the next run
+MAX_RATE_LIMIT_RETRIES = 3
+
+# Failed flushes after which a report is moved to the dead letters instead of being retried again
+MAX_DELIVERY_ATTEMPTS = 5
+
+_compress_bytes = DEFAULT_COMPRESS_BYTES
+# Monotonic time until which each webhook's rate limit bucket is exhausted
+_blocked_until = {}
+_lock = threading.Lock()
+
+# Function to apply "discord_compress_bytes" from the properties
+def configure(properties):
+    global _compress_bytes
+    _compress_bytes = properties.get('discord_compress_bytes', DEFAULT_COMPRESS_BYTES)
+
+# Function to open the outbox, creating the schema if needed
+# Every report is written here before it is sent and deleted once Discord accepted it
+def _connect():
+    conn = sqlite3.connect(get_data_path(DB_FILENAME), timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            webhook_url TEXT NOT NULL,
+            message TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS attachments (
+            outbox_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            content BLOB NOT NULL,
+            PRIMARY KEY (outbox_id, position)
+        )
+    ''')
+    # Reports Discord rejected (4xx other than 429) or that failed MAX_DELIVERY_ATTEMPTS times, kept with their attachments for inspection
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS dead_letters (
+            id INTEGER PRIMARY KEY,
+            webhook_url TEXT NOT NULL,
+            message TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            failed_at TEXT NOT NULL
+        )
+    ''')
+    return conn
+
+# Function to serialize a DataFrame to CSV bytes in memory, no temporary file
+def dataframe_attachment(df, filename, encoding='big5'):
+    buffer = io.BytesIO()
+    df.to_csv(buffer, index=False, encoding=encoding, errors='replace')
+    return filename, buffer.getvalue()
+
+# Function to gzip an attachment above the size threshold
+def _compress(filename, content):
+    if len(content) <= _compress_bytes:
+        return filename, content
+    return f'{filename}.gz', gzip.compress(content)
+
+# Function to add a report to the outbox, attachments are (filename, bytes) pairs; returns the outbox id
+def enqueue(webhook_url, message, attachments=()):
+    conn = _connect()
+    try:
+        with conn:
+            outbox_id = conn.execute('INSERT INTO outbox (webhook_url, message, created_at) VALUES (?, ?, ?)',
+                                     (webhook_url, message, datetime.now().isoformat(timespec='seconds'))).lastrowid
+            conn.executemany('INSERT INTO attachments (outbox_id, position, filename, content) VALUES (?, ?, ?, ?)',
+                             [(outbox_id, position) + _compress(filename, content) for position, (filename, content) in enumerate(attachments)])
+    finally:
+        conn.close()
+    return outbox_id
+
+# Function to load pending reports (all, or only the given ids) as dicts, oldest first
+def _load_pending(outbox_ids=None):
+    conn = _connect()
+    try:
+        rows = conn.execute('SELECT id, webhook_url, message, attempts FROM outbox ORDER BY id').fetchall()
+        items = []
+        for outbox_id, webhook_url, message, attempts in rows:
+            if outbox_ids is not None and outbox_id not in outbox_ids:
+                continue
+            attachments = conn.execute('SELECT filename, content FROM attachments WHERE outbox_id = ? ORDER BY position', (outbox_id,)).fetchall()
+            items.append({'id': outbox_id, 'webhook_url': webhook_url, 'message': message, 'attempts': attempts, 'attachments': attachments})
+    finally:
+        conn.close()
+    return items
+
+# Function to move a report from the outbox to the dead letters, it is not sent again
+def _dead_letter(conn, outbox_id, reason):
+    conn.execute('INSERT OR REPLACE INTO dead_letters (id, webhook_url, message, created_at, attempts, reason, failed_at) '
+                 'SELECT id, webhook_url, message, created_at, attempts, ?, ? FROM outbox WHERE id = ?',
+                 (reason, datetime.now().isoformat(timespec='seconds'), outbox_id))
+    conn.execute('DELETE FROM outbox WHERE id = ?', (outbox_id,))
+    logger.error(f"Discord report {outbox_id} moved to the dead letters: {reason}")
+
+def _finish(outbox_ids, delivered):
+    conn = _connect()
+    try:
+        with conn:
+            for outbox_id in outbox_ids:
+                if delivered:
+                    conn.execute('DELETE FROM attachments WHERE outbox_id = ?', (outbox_id,))
+                    conn.execute('DELETE FROM outbox WHERE id = ?', (outbox_id,))
+                    continue
+                conn.execute('UPDATE outbox SET attempts = attempts + 1 WHERE id = ?', (outbox_id,))
+                attempts = conn.execute('SELECT attempts FROM outbox WHERE id = ?', (outbox_id,)).fetchone()
+                if attempts and attempts[0] >= MAX_DELIVERY_ATTEMPTS:
+                    _dead_letter(conn, outbox_id, f'failed {attempts[0]} times')
+    finally:
+        conn.close()
+
+# Function to dead-letter a report Discord rejected
+def _reject(outbox_id, status_code):
+    conn = _connect()
+    try:
+        with conn:
+            _dead_letter(conn, outbox_id, f'rejected with status {status_code}')
+    finally:
+        conn.close()
+
+# A 4xx other than 429 won't succeed on retry, e.g. 413 for a too large attachment
+def _is_rejected(status_code):
+    return status_code is not None and 400 <= status_code < 500 and status_code != 429
+
+# Function to group reports of the same webhook into messages of at most 10 files and 2000 characters
+# Reports that failed before are sent on their own, so they can't hold back fresh ones
+def _batch(items):
+    batches = []
+    for item in items:
+        batch = batches[-1] if batches else None
+        if (batch is None or batch[0]['webhook_url'] != item['webhook_url'] or item['attempts'] or batch[0]['attempts']
+                or sum(len(queued['attachments']) for queued in batch) + len(item['attachments']) > MAX_FILES_PER_MESSAGE
+                or len('\n'.join(queued['message'] for queued in batch + [item])) > MAX_CONTENT_LENGTH):
+            batches.append([item])
+        else:
+            batch.append(item)
+    return batches
+
+# Function to wait until the webhook's rate limit bucket has room
+def _wait_for_bucket(webhook_url):
+    with _lock:
+        delay = _blocked_until.get(webhook_url, 0) - time.monotonic()
+    if delay > 0:
+        logger.info(f"Waiting {delay:.1f}s for the Discord rate limit")
+        time.sleep(delay)
+
+# Function to remember when the bucket empties from the X-RateLimit headers, returns the wait of a 429 response
+def _update_bucket(webhook_url, response):
+    retry_after = None
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.json().get('retry_after'))
+        except (ValueError, TypeError, AttributeError):
+            retry_after = float(response.headers.get('Retry-After', 1))
+    elif response.headers.get('X-RateLimit-Remaining') == '0':
+        retry_after = float(response.headers.get('X-RateLimit-Reset-After', 1))
+
+    if retry_after is not None:
+        with _lock:
+            _blocked_until[webhook_url] = max(_blocked_until.get(webhook_url, 0), time.monotonic() + retry_after)
+    return retry_after
+
+# Function to send one batch as a single webhook call, returns the status code of the response, None if the request failed
+def _send_batch(batch):
+    webhook_url = batch[0]['webhook_url']
+    payload = {'content': '\n'.join(item['message'] for item in batch)}
+    attachments = [attachment for item in batch for attachment in item['attachments']]
+    files = {f'files[{position}]': (filename, content) for position, (filename, content) in enumerate(attachments)}
+
+    for _ in range(MAX_RATE_LIMIT_RETRIES + 1):
+        _wait_for_bucket(webhook_url)
+        try:
+            # Without the session's retries, rate limits are only handled here with the webhook's bucket
+            response = http_client.post(webhook_url, retry=False, data=payload, files=files)
+        except Exception as e:
+            logger.error(f"Fail to send to Discord webhook: {e}")
+            return None
+        _update_bucket(webhook_url, response)
+        if response.status_code != 429:
+            break
+
+    if response.status_code not in (200, 204):
+        logger.error(f"Failed to send to Discord webhook. Status Code: {response.status_code}")
+    return response.status_code
+
+# Function to send pending reports, batched per webhook; everything still in the outbox when outbox_ids is None
+# Returns the ids delivered, undelivered reports stay in the outbox for the next flush
+# A rejected batch is split and sent report by report, the rejected report is dead-lettered and the others go through
+def flush(outbox_ids=None):
+    delivered = set()
+    batches = _batch(_load_pending(outbox_ids))
+    while batches:
+        batch = batches.pop(0)
+        ids = [item['id'] for item in batch]
+        status_code = _send_batch(batch)
+        if status_code in (200, 204):
+            delivered.update(ids)
+            _finish(ids, True)
+        elif _is_rejected(status_code) and len(batch) > 1:
+            batches[:0] = [[item] for item in batch]
+        elif _is_rejected(status_code):
+            _reject(ids[0], status_code)
+        else:
+            _finish(ids, False)
+    return delivered
+
+# Function to send one report right away, through the outbox so a failed upload is retried by a later flush
+# Returns True when Discord accepted it
+def deliver(webhook_url, message, attachments=()):
+    outbox_id = enqueue(webhook_url, message, attachments)
+    return outbox_id in flush({outbox_id})
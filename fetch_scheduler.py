@@ -0,0 +1,72 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+# Default request budgets per host: "rate" requests per second, bursts of up to "burst" requests
+DEFAULT_RATE_LIMITS = {
+    'twse.com.tw': {'rate': 0.5, 'burst': 2},
+    'tpex.org.tw': {'rate': 0.5, 'burst': 2},
+    'goodinfo.tw': {'rate': 0.2, 'burst': 1},
+}
+
+DEFAULT_MAX_WORKERS = 4
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Block until a token is available, returns the seconds spent waiting
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+            waited += wait_seconds
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_rate_limits = dict(DEFAULT_RATE_LIMITS)
+_max_workers = DEFAULT_MAX_WORKERS
+
+# Function to apply the "rate_limits" and "max_workers" settings from config.json
+def configure(properties):
+    global _max_workers
+    with _buckets_lock:
+        _rate_limits.update(properties.get('rate_limits', {}))
+        _buckets.clear()
+    _max_workers = properties.get('max_workers', DEFAULT_MAX_WORKERS)
+
+# Function to find the token bucket of a URL's host, hosts without a configured limit are not throttled
+def _get_bucket(url):
+    hostname = urlparse(url).hostname or ''
+    for domain, limit in _rate_limits.items():
+        if hostname == domain or hostname.endswith('.' + domain):
+            with _buckets_lock:
+                if domain not in _buckets:
+                    _buckets[domain] = TokenBucket(limit['rate'], limit['burst'])
+                return _buckets[domain]
+    return None
+
+# Function to wait for the request budget of a URL's host, returns the seconds spent waiting
+def acquire(url):
+    bucket = _get_bucket(url)
+    if bucket is None:
+        return 0.0
+    return bucket.acquire()
+
+# Function to run func over items on a thread pool, results keep the order of items
+def map_concurrently(func, items, max_workers=None):
+    with ThreadPoolExecutor(max_workers=max_workers or _max_workers) as executor:
+        return list(executor.map(func, items))
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+import http_client
+from data_paths import get_data_path
+from logger_config import setup_logger
+
+# Set up the logger
+logger = setup_logger()
+
+TABLE_ID = 'tblStockList'
+
+# Last downloaded page: validators for conditional requests and the extracted table
+CACHE_FILENAME = 'goodinfo_stock_list.json'
+
+# Bytes fed to the streaming parser at a time
+CHUNK_SIZE = 64 * 1024
+
+# Column holding the symbol, rows are deduplicated on it
+SYMBOL_COLUMN = '代號'
+
+# Columns kept as text even though they look numeric
+TEXT_COLUMNS = (SYMBOL_COLUMN, '名稱')
+
+# Streaming extraction with lxml's pull parser, stops reading at the end of the table
+# Yields the cell texts of every row of the table
+def _rows_lxml(content):
+    from lxml import etree
+
+    parser = etree.HTMLPullParser(events=('start', 'end'), encoding='utf-8')
+    table_depth = 0
+    for offset in range(0, len(content), CHUNK_SIZE):
+        parser.feed(content[offset:offset + CHUNK_SIZE])
+        for event, element in parser.read_events():
+            if element.tag == 'table' and (table_depth or element.get('id') == TABLE_ID):
+                table_depth += 1 if event == 'start' else -1
+                if event == 'end' and table_depth == 0:
+                    return
+                continue
+            if event != 'end':
+                continue
+            if table_depth and element.tag == 'tr':
+                yield [''.join(cell.itertext()).strip() for cell in element if cell.tag in ('td', 'th')]
+                element.clear()
+            elif not table_depth:
+                # Drop the markup before the table as soon as it's parsed
+                element.clear()
+
+# Extraction with selectolax (lexbor), parses the page in C and only walks the table
+def _rows_selectolax(content):
+    from selectolax.parser import HTMLParser
+
+    table = HTMLParser(content).css_first(f'table#{TABLE_ID}')
+    if table is None:
+        return
+    for row in table.css('tr'):
+        yield [cell.text(strip=True) for cell in row.css('th, td')]
+
+# Extraction with BeautifulSoup, the fallback when neither lxml nor selectolax is installed
+# Same full html.parser tree as before this module: a SoupStrainer limited to the table measured slower on StockList pages
+def _rows_bs4(content):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, 'html.parser')
+    table = soup.find('table', {'id': TABLE_ID})
+    if table is None:
+        return
+    for row in table.find_all('tr'):
+        yield [cell.text.strip() for cell in row.find_all(['th', 'td'])]
+
+# Parser backends by name, "auto" picks the first one installed in this order
+PARSERS = {
+    'lxml': _rows_lxml,
+    'selectolax': _rows_selectolax,
+    'bs4': _rows_bs4,
+}
+
+# Function to get the names of the installed parser backends, each is named after its module
+def available_parsers():
+    available = []
+    for name in PARSERS:
+        try:
+            __import__(name)
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+def _resolve_parser(parser):
+    available = available_parsers()
+    if parser == 'auto':
+        if not available:
+            raise ImportError("No HTML parser installed, install lxml, selectolax or beautifulsoup4")
+        return available[0]
+    if parser not in available:
+        raise ImportError(f"HTML parser not installed: {parser}")
+    return parser
+
+# Cell texts goodinfo uses for "no value"
+EMPTY_CELLS = ('', '-')
+
+# Function to turn a column of cell texts into numbers when every non-empty cell is one, e.g. "1,234" or "+2.5"
+def _typed_column(values):
+    numbers = pd.to_numeric(pd.Series(values, dtype=object).str.replace(',', '', regex=False), errors='coerce')
+    if numbers.notna().sum() == sum(1 for value in values if value not in EMPTY_CELLS):
+        return numbers
+    return values
+
+# Function to extract the stock table of a StockList page into a DataFrame with typed columns
+# Header rows repeated inside the table and duplicated symbols are skipped while reading
+def parse_stock_table(content, parser='auto'):
+    parser = _resolve_parser(parser)
+    headers = None
+    columns = None
+    symbol_index = None
+    seen = set()
+    for cells in PARSERS[parser](content):
+        if headers is None:
+            headers = cells
+            columns = [[] for _ in headers]
+            symbol_index = headers.index(SYMBOL_COLUMN) if SYMBOL_COLUMN in headers else None
+            continue
+        if cells == headers or len(cells) != len(headers):
+            continue
+        if symbol_index is not None:
+            if cells[symbol_index] in seen:
+                continue
+            seen.add(cells[symbol_index])
+        for column, cell in zip(columns, cells):
+            column.append(cell)
+
+    if headers is None:
+        return None
+    return pd.DataFrame({header: column if header in TEXT_COLUMNS else _typed_column(column) for header, column in zip(headers, columns)})
+
+def _load_cache(url):
+    cache_path = get_data_path(CACHE_FILENAME)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return cache if cache.get('url') == url else None
+
+def _save_cache(cache):
+    with open(get_data_path(CACHE_FILENAME), 'w', encoding='utf-8') as file:
+        json.dump(cache, file, ensure_ascii=False)
+
+def _cached_table(cache):
+    return pd.DataFrame(cache['data'], columns=cache['columns'])
+
+# Function to download and extract the stock table of a StockList page, returns a DataFrame or None
+# Sends the ETag / Last-Modified of the last download, an unchanged page (304 or same body) is not parsed again
+def fetch_stock_table(url, headers=None, parser='auto'):
+    cache = _load_cache(url)
+    request_headers = dict(headers or {})
+    if cache is not None:
+        if cache.get('etag'):
+            request_headers['If-None-Match'] = cache['etag']
+        if cache.get('last_modified'):
+            request_headers['If-Modified-Since'] = cache['last_modified']
+
+    response = http_client.get(url, headers=request_headers)
+    if response.status_code == 304 and cache is not None:
+        logger.info("Stock list not modified since the last download.")
+        return _cached_table(cache)
+    response.raise_for_status()
+
+    digest = hashlib.sha256(response.content).hexdigest()
+    if cache is not None and cache.get('sha256') == digest:
+        logger.info("Stock list unchanged since the last download.")
+        return _cached_table(cache)
+
+    table = parse_stock_table(response.content, parser)
+    if table is None:
+        return None
+
+    payload = json.loads(table.to_json(orient='split', force_ascii=False))
+    _save_cache({
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'sha256': digest,
+        'columns': payload['columns'],
+        'data': payload['data'],
+    })
+    return table
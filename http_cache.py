@@ -0,0 +1,203 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+import http_client
+import memory_budget
+import metrics
+from data_paths import get_data_path
+
+DB_FILENAME = 'http_cache.db'
+
+# Responses kept in memory, least recently used first out
+DEFAULT_MEMORY_ENTRIES = 256
+# Size of the disk store, least recently used responses are evicted beyond it
+DEFAULT_DISK_MB = 200
+# Lifetime of responses for today (the current month for monthly pages), past dates never change
+DEFAULT_TODAY_TTL_MINUTES = 10
+
+# Cached endpoints by the last segment of their path, and the period their date parameter refers to
+ENDPOINT_PERIODS = {
+    'STOCK_DAY': 'month',
+    'st43_result.php': 'month',
+    'MI_INDEX': 'day',
+    'stk_quote_result.php': 'day',
+    'T86': 'day',
+    '3itrade_hedge_result.php': 'day',
+}
+
+_enabled = True
+_memory_entries = DEFAULT_MEMORY_ENTRIES
+_disk_bytes = DEFAULT_DISK_MB * 1024 * 1024
+_today_ttl = DEFAULT_TODAY_TTL_MINUTES * 60
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+
+# Function to apply the "http_cache" settings from the properties, e.g.
+# "http_cache": {"enabled": true, "memory_entries": 256, "disk_mb": 200, "today_ttl_minutes": 10}
+def configure(properties):
+    global _enabled, _memory_entries, _disk_bytes, _today_ttl
+    settings = properties.get('http_cache', {})
+    _enabled = settings.get('enabled', True)
+    _memory_entries = settings.get('memory_entries', DEFAULT_MEMORY_ENTRIES)
+    _disk_bytes = settings.get('disk_mb', DEFAULT_DISK_MB) * 1024 * 1024
+    _today_ttl = settings.get('today_ttl_minutes', DEFAULT_TODAY_TTL_MINUTES) * 60
+
+# Function to open the disk store, creating the schema if needed
+def _connect():
+    conn = sqlite3.connect(get_data_path(DB_FILENAME), timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            content_type TEXT,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            expires_at REAL,
+            last_access REAL NOT NULL
+        )
+    ''')
+    return conn
+
+# Function to read the date a request refers to: "date=YYYYMMDD" (TWSE) or "d=yyy/mm/dd" / "d=yyy/mm" in the Taiwan calendar (TPEx)
+# Returns None when the request has no date, i.e. it asks for today
+def _query_date(query):
+    params = parse_qs(query)
+    if 'date' in params:
+        return datetime.strptime(params['date'][0][:8], '%Y%m%d').date()
+    if 'd' in params:
+        parts = [int(part) for part in params['d'][0].split('/')]
+        return datetime(parts[0] + 1911, parts[1], parts[2] if len(parts) > 2 else 1).date()
+    return None
+
+# Function to get the lifetime of a response in seconds: None for immutable data, 0 for responses that are not cached
+def get_ttl(url):
+    parts = urlsplit(url)
+    period = ENDPOINT_PERIODS.get(parts.path.rstrip('/').split('/')[-1])
+    if period is None:
+        return 0
+    try:
+        day = _query_date(parts.query)
+    except (ValueError, IndexError):
+        return 0
+
+    today = datetime.now().date()
+    if day is None:
+        return _today_ttl
+    if period == 'month':
+        return None if (day.year, day.month) < (today.year, today.month) else _today_ttl
+    return None if day < today else _today_ttl
+
+def _to_response(url, content_type, body):
+    response = Response()
+    response.status_code = 200
+    response.url = url
+    response._content = body
+    response.headers = CaseInsensitiveDict({'Content-Type': content_type} if content_type else {})
+    return response
+
+def _memory_get(url, now):
+    with _lock:
+        entry = _memory.get(url)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= now:
+            del _memory[url]
+            return None
+        _memory.move_to_end(url)
+        return entry
+
+def _memory_put(url, entry):
+    with _lock:
+        _memory[url] = entry
+        _memory.move_to_end(url)
+        while len(_memory) > _memory_entries:
+            _memory.popitem(last=False)
+
+# Function to drop the in-memory responses, the disk store keeps them
+def clear_memory():
+    with _lock:
+        _memory.clear()
+
+# Over the memory budget the in-memory responses are dropped, they are still served from disk
+memory_budget.register_releaser(clear_memory)
+
+def _disk_get(url, now):
+    conn = _connect()
+    try:
+        with conn:
+            row = conn.execute('SELECT expires_at, content_type, body FROM responses WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            if row[0] is not None and row[0] <= now:
+                conn.execute('DELETE FROM responses WHERE url = ?', (url,))
+                return None
+            conn.execute('UPDATE responses SET last_access = ? WHERE url = ?', (now, url))
+    finally:
+        conn.close()
+    return row
+
+# Function to store a response on disk, evicting the least recently used ones beyond the size limit
+def _disk_put(url, entry, now):
+    expires_at, content_type, body = entry
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO responses (url, content_type, body, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?)',
+                         (url, content_type, body, len(body), expires_at, now))
+            conn.execute('DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?', (now,))
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total > _disk_bytes:
+                # Evict down to 90% of the limit so the next few inserts don't evict again
+                excess = total - _disk_bytes * 0.9
+                evicted = []
+                for old_url, size in conn.execute('SELECT url, size FROM responses ORDER BY last_access'):
+                    if excess <= 0:
+                        break
+                    evicted.append((old_url,))
+                    excess -= size
+                conn.executemany('DELETE FROM responses WHERE url = ?', evicted)
+    finally:
+        conn.close()
+
+def _is_valid(response, validate):
+    if validate is None:
+        return True
+    try:
+        return bool(validate(response))
+    except ValueError:
+        return False
+
+# Function to GET a URL through the memory and disk caches, returns a requests Response
+# Only successful responses of the endpoints in ENDPOINT_PERIODS are cached, everything else goes to http_client
+# validate(response) can reject a response from being cached, e.g. a throttling page instead of JSON
+def get(url, validate=None, **kwargs):
+    ttl = get_ttl(url) if _enabled else 0
+    if ttl == 0:
+        return http_client.get(url, **kwargs)
+
+    now = time.time()
+    entry = _memory_get(url, now)
+    if entry is not None:
+        metrics.record_cache('memory_hit')
+        return _to_response(url, entry[1], entry[2])
+
+    entry = _disk_get(url, now)
+    if entry is not None:
+        metrics.record_cache('disk_hit')
+        _memory_put(url, entry)
+        return _to_response(url, entry[1], entry[2])
+
+    metrics.record_cache('miss')
+    response = http_client.get(url, **kwargs)
+    if response.status_code == 200 and response.content and _is_valid(response, validate):
+        entry = (now + ttl if ttl is not None else None, response.headers.get('Content-Type'), response.content)
+        _memory_put(url, entry)
+        _disk_put(url, entry, now)
+    return response
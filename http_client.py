@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import fetch_scheduler
+import metrics
+from logger_config import setup_logger
+
+# Set up the logger
+logger = setup_logger()
+
+# Default (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (5, 30)
+
+# Retry up to 3 times with 1 s, 2 s, 4 s backoff, Retry-After headers take precedence
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 1
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Keep-alive connections kept per host
+POOL_MAXSIZE = 10
+
+# Base URL of a local replay server (see benchmark/), every request is sent there instead when set
+REPLAY_URL = os.environ.get('TWSR_REPLAY_URL')
+
+class _Retry(Retry):
+    # A POST that failed with a server error may have been processed, only retry it when rate limited
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == 'POST' and status_code != 429:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+# Shared sessions by whether they retry, created on first use
+_sessions = {}
+_session_lock = threading.Lock()
+
+# Function to get the shared session, created on first use
+# retry=False gives a session without retries for callers handling failures and rate limits themselves (the Discord outbox)
+def get_session(retry=True):
+    with _session_lock:
+        if retry not in _sessions:
+            if retry:
+                max_retries = _Retry(
+                    total=RETRY_TOTAL,
+                    backoff_factor=RETRY_BACKOFF_FACTOR,
+                    status_forcelist=RETRY_STATUS_CODES,
+                    allowed_methods=frozenset(['HEAD', 'GET', 'POST']),
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+            else:
+                max_retries = Retry(0, read=False, redirect=False, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=POOL_MAXSIZE, max_retries=max_retries)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[retry] = session
+        return _sessions[retry]
+
+# Function to rewrite a URL to the replay server, keeping the original host as the first path segment
+def _to_replay_url(url):
+    parts = urlsplit(url)
+    query = f'?{parts.query}' if parts.query else ''
+    return f"{REPLAY_URL.rstrip('/')}/{parts.netloc}{parts.path}{query}"
+
+# Function to send a request through the shared session, waiting for the host's request budget first
+# Latency, bytes, retries and budget waits are recorded per host in metrics, retry=False sends it without retries
+def request(method, url, retry=True, **kwargs):
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    host = urlsplit(url).hostname or ''
+    metrics.record_wait(host, fetch_scheduler.acquire(url))
+    if REPLAY_URL:
+        url = _to_replay_url(url)
+
+    started = time.perf_counter()
+    try:
+        response = get_session(retry).request(method, url, **kwargs)
+    except requests.exceptions.RequestException as e:
+        latency = time.perf_counter() - started
+        metrics.record_request(host, 'error', latency)
+        logger.debug(f"{method} failed: {e}", extra={'url': url, 'latency': round(latency, 3), 'outcome': 'error'})
+        raise
+
+    latency = time.perf_counter() - started
+    retries = response.raw.retries
+    body = response.request.body
+    # Sampled, see logger_config.set_debug_sample
+    logger.debug(f"{method} {response.status_code}", extra={'url': url, 'latency': round(latency, 3), 'outcome': response.status_code})
+    metrics.record_request(
+        host,
+        response.status_code,
+        latency,
+        # Reading the body of a streamed response is left to the caller
+        response_bytes=0 if kwargs.get('stream') else len(response.content),
+        request_bytes=len(body) if isinstance(body, (bytes, str)) else 0,
+        retries=len(retries.history) if retries is not None else 0,
+    )
+    return response
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
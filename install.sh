@@ -18,21 +18,38 @@ sudo apt-get install cron -y
 sudo apt install -y python3 python3-pip
 
 # Install required Python packages
-pip3 install requests discord-webhook pandas beautifulsoup4
+pip3 install requests pandas beautifulsoup4 lxml
 
 # Get the path to the current script
 SCRIPT_PATH="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 
+# Remove cron schedules of earlier installs, the daemon runs the reports now
 # Remove existing schedule for daily_3insti_report.py
 remove_existing_schedule "daily_3insti_report.py"
 
 # Remove existing schedule for daily_stock_report.py
 remove_existing_schedule "daily_stock_report.py"
 
-# Create cron jobs to send daily report on weekdays
-(crontab -l 2>/dev/null; echo "15 16 * * 1-5 /usr/bin/python3 $SCRIPT_PATH/daily_3insti_report.py") | crontab -
-(crontab -l 2>/dev/null; echo "0 17 * * 1-5 /usr/bin/python3 $SCRIPT_PATH/daily_stock_report.py") | crontab -
-
-
-echo "Installation complete. Daily stock report script scheduled to run on weekdays."
-crontab -l
+# Run both reports from one long-running daemon (16:15 and 17:00 on weekdays) instead of cron
+sudo tee /etc/systemd/system/twstockreporter.service > /dev/null <<EOF
+[Unit]
+Description=TWStockReporter daily report daemon
+After=network-online.target
+Wants=network-online.target
+
+[Service]
+User=$USER
+WorkingDirectory=$SCRIPT_PATH
+ExecStart=/usr/bin/python3 $SCRIPT_PATH/daemon.py
+Restart=on-failure
+RestartSec=60
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+sudo systemctl daemon-reload
+sudo systemctl enable --now twstockreporter.service
+
+echo "Installation complete. Daily reports scheduled on weekdays by twstockreporter.service."
+systemctl status twstockreporter.service --no-pager
@@ -0,0 +1,272 @@
+import argparse
+import csv
+import io
+import json
+import sqlite3
+from datetime import datetime
+from urllib.parse import quote
+
+import pandas as pd
+
+import fetch_scheduler
+import http_cache
+import trading_calendar
+from data_paths import get_data_path
+from logger_config import setup_logger
+
+# Set up the logger
+logger = setup_logger()
+
+DB_FILENAME = 'institutional_flows.db'
+
+MARKETS = ('TWSE', 'TPEX')
+
+# Trading days replayed when the streaks have to be rebuilt, longer streaks are reported as this many days
+STREAK_MAX_DAYS = 60
+
+# Column names of the symbol, name and foreign/trust/dealer net shares in the T86 and 3itrade_hedge_result CSVs
+CSV_COLUMNS = {
+    'TWSE': {
+        'stock_number': ('證券代號',),
+        'name': ('證券名稱',),
+        'foreign': ('外陸資買賣超股數(不含外資自營商)', '外資買賣超股數'),
+        'trust': ('投信買賣超股數',),
+        'dealer': ('自營商買賣超股數',),
+    },
+    'TPEX': {
+        'stock_number': ('代號',),
+        'name': ('名稱',),
+        'foreign': ('外資及陸資(不含外資自營商)-買賣超股數', '外資及陸資-買賣超股數'),
+        'trust': ('投信-買賣超股數',),
+        'dealer': ('自營商-買賣超股數',),
+    },
+}
+
+FLOW_KEYS = ('stock_number', 'name', 'foreign', 'trust', 'dealer')
+
+# Function to open the institutional flow database, creating the schema if needed
+# Flows are stored per market and date as columns: {"stock_number": [...], "name": [...], "foreign": [...], ...}
+def _connect():
+    conn = sqlite3.connect(get_data_path(DB_FILENAME), timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_flows (
+            market TEXT NOT NULL,
+            trade_date TEXT NOT NULL,
+            trading INTEGER NOT NULL,
+            flows TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (market, trade_date)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS streak_state (
+            market TEXT PRIMARY KEY,
+            as_of TEXT NOT NULL,
+            streaks TEXT NOT NULL
+        )
+    ''')
+    return conn
+
+def _execute(statement, parameters=()):
+    conn = _connect()
+    try:
+        with conn:
+            return conn.execute(statement, parameters).fetchall()
+    finally:
+        conn.close()
+
+def get_csv_url(market, date_time: datetime):
+    if market == 'TWSE':
+        return f'https://www.twse.com.tw/rwd/zh/fund/T86?date={date_time.strftime("%Y%m%d")}&selectType=ALLBUT0999&response=csv'
+    taiwan_date_string = f'{date_time.year - 1911}/{date_time.strftime("%m/%d")}'
+    return f'https://www.tpex.org.tw/web/stock/3insti/daily_trade/3itrade_hedge_result.php?l=zh-tw&o=csv&se=EW&t=D&d={quote(taiwan_date_string)}'
+
+def _parse_shares(value):
+    try:
+        return int(value.replace(',', '').strip())
+    except ValueError:
+        return None
+
+# Function to parse a T86 (TWSE) or 3itrade_hedge_result (TPEx) CSV (Big5 bytes as published) into columns
+# The bytes are decoded line by line as the rows are read, no decoded copy of the whole file is made
+# Returns an empty dict when the file has no records, e.g. on a non-trading day
+def parse_csv(market, content):
+    names = CSV_COLUMNS[market]
+    indexes = None
+    flows = {key: [] for key in FLOW_KEYS}
+
+    for row in csv.reader(io.TextIOWrapper(io.BytesIO(content), encoding='cp950', errors='replace', newline='')):
+        cells = [cell.strip() for cell in row]
+        if indexes is None:
+            # Title lines come before the header
+            if names['stock_number'][0] in cells:
+                indexes = {}
+                for key, candidates in names.items():
+                    indexes[key] = next((cells.index(name) for name in candidates if name in cells), None)
+                if None in indexes.values():
+                    logger.error(f"({market}) Unexpected institutional CSV header: {cells}")
+                    return {}
+            continue
+
+        if len(cells) <= max(indexes.values()):
+            # Notes after the records
+            continue
+        # TWSE writes symbols as ="0050" to keep the leading zeros in spreadsheets
+        stock_number = cells[indexes['stock_number']].lstrip('=').strip('"').strip()
+        shares = [_parse_shares(cells[indexes[key]]) for key in ('foreign', 'trust', 'dealer')]
+        if not stock_number or None in shares:
+            continue
+
+        flows['stock_number'].append(stock_number)
+        flows['name'].append(cells[indexes['name']])
+        for key, value in zip(('foreign', 'trust', 'dealer'), shares):
+            flows[key].append(value)
+
+    return flows if flows['stock_number'] else {}
+
+# Function to tell whether a T86 or 3itrade_hedge_result CSV has any records, whatever its header says
+# Only the layout is checked (a symbol followed by share counts), so a renamed column doesn't hide a published file
+def has_records(content):
+    for row in csv.reader(io.TextIOWrapper(io.BytesIO(content), encoding='cp950', errors='replace', newline='')):
+        cells = [cell.strip() for cell in row]
+        if len(cells) < 5:
+            continue
+        stock_number = cells[0].lstrip('=').strip('"').strip()
+        if stock_number[:1].isdigit() and sum(_parse_shares(cell) is not None for cell in cells[1:]) >= 3:
+            return True
+    return False
+
+# Function to load the flows of a date, returns the columns, an empty dict for a non-trading day, or None if not stored
+def load_flows(market, date_time: datetime):
+    rows = _execute('SELECT trading, flows FROM daily_flows WHERE market = ? AND trade_date = ?', (market, date_time.strftime('%Y%m%d')))
+    if not rows:
+        return None
+    return json.loads(rows[0][1]) if rows[0][0] else {}
+
+# Function to save the flows of a date, an empty dict marks a non-trading day
+def save_flows(market, date_time: datetime, flows):
+    _execute('INSERT OR REPLACE INTO daily_flows (market, trade_date, trading, flows, updated_at) VALUES (?, ?, ?, ?, ?)',
+             (market, date_time.strftime('%Y%m%d'), 1 if flows else 0, json.dumps(flows, ensure_ascii=False), datetime.now().isoformat(timespec='seconds')))
+
+# Function to store a CSV already downloaded elsewhere (daily_3insti_report.py), returns the parsed columns
+def save_csv(market, date_time: datetime, content):
+    flows = parse_csv(market, content)
+    if flows:
+        save_flows(market, date_time, flows)
+    return flows
+
+# Function to get the flows of a date from the store, downloading the CSV when it isn't stored
+# Returns the columns, an empty dict for a non-trading day, or None if the request failed
+def get_flows(market, date_time: datetime):
+    flows = load_flows(market, date_time)
+    if flows is not None:
+        return flows
+
+    try:
+        response = http_cache.get(get_csv_url(market, date_time))
+        response.raise_for_status()
+    except Exception as e:
+        logger.error(f"({market}) Fail to retrieve institutional flows, date: {date_time.strftime('%Y%m%d')} error: {e}")
+        return None
+
+    flows = parse_csv(market, response.content)
+    # Today's file may not be published yet, only past dates are stored as non-trading days
+    if flows or date_time.date() < datetime.now().date():
+        save_flows(market, date_time, flows)
+    return flows
+
+# Function to advance the streaks by one day's flows, O(symbols)
+# A streak counts consecutive days of foreign net buying (positive) or selling (negative), 0 breaks it
+def apply_flows(streaks, flows):
+    updated = {}
+    for stock_number, foreign in zip(flows['stock_number'], flows['foreign']):
+        previous = streaks.get(stock_number, 0)
+        if foreign > 0:
+            updated[stock_number] = previous + 1 if previous > 0 else 1
+        elif foreign < 0:
+            updated[stock_number] = previous - 1 if previous < 0 else -1
+        else:
+            updated[stock_number] = 0
+    return updated
+
+def _load_state(market):
+    rows = _execute('SELECT as_of, streaks FROM streak_state WHERE market = ?', (market,))
+    if not rows:
+        return None, {}
+    return datetime.strptime(rows[0][0], '%Y%m%d').date(), json.loads(rows[0][1])
+
+def _save_state(market, as_of, streaks):
+    _execute('INSERT OR REPLACE INTO streak_state (market, as_of, streaks) VALUES (?, ?, ?)', (market, as_of.strftime('%Y%m%d'), json.dumps(streaks)))
+
+# Function to get the foreign buying streaks of every stock on a date as {market: {stock_number: streak}}
+# Only the days after the stored state are applied, the state is rebuilt from the last STREAK_MAX_DAYS days when it's too old
+# Returns None if the flows of a needed day can't be retrieved
+def get_streaks(date_time: datetime, max_days=STREAK_MAX_DAYS):
+    target = date_time.date() if isinstance(date_time, datetime) else date_time
+    window = trading_calendar.previous_trading_days(target, max_days) + [target]
+
+    pending = {}
+    states = {}
+    for market in MARKETS:
+        as_of, streaks = _load_state(market)
+        if as_of is not None and window[0] <= as_of <= target:
+            pending[market] = [day for day in window if day > as_of]
+        else:
+            as_of, streaks = None, {}
+            pending[market] = window
+        states[market] = (as_of, streaks)
+
+    # Download the missing days of both markets concurrently, requests are throttled per host by the fetch scheduler
+    jobs = [(market, datetime.combine(day, datetime.min.time())) for market in MARKETS for day in pending[market]]
+    results = dict(zip(jobs, fetch_scheduler.map_concurrently(lambda job: get_flows(*job), jobs)))
+
+    all_streaks = {}
+    for market in MARKETS:
+        as_of, streaks = states[market]
+        for day in pending[market]:
+            flows = results[(market, datetime.combine(day, datetime.min.time()))]
+            if flows is None:
+                return None
+            if not flows:
+                if day == target:
+                    logger.error(f"({market}) No institutional flows for {target.strftime('%Y%m%d')}")
+                    return None
+                continue
+            streaks = apply_flows(streaks, flows)
+            as_of = day
+
+        _save_state(market, as_of, streaks)
+        all_streaks[market] = streaks
+    return all_streaks
+
+# Function to build the table of every stock's streak and net shares on a date, returns a DataFrame or None
+# Columns are typed: categorical name and market, int64 net shares, int16 streaks
+def get_streak_table(date_time: datetime, max_days=STREAK_MAX_DAYS):
+    streaks = get_streaks(date_time, max_days)
+    if streaks is None:
+        return None
+
+    frames = []
+    for market in MARKETS:
+        flows = load_flows(market, date_time)
+        frame = pd.DataFrame(flows, columns=list(FLOW_KEYS))
+        frame['market'] = market
+        frame['foreign_streak'] = frame['stock_number'].map(streaks[market]).fillna(0)
+        frames.append(frame)
+    table = pd.concat(frames, ignore_index=True)
+    return table.astype({'name': 'category', 'market': 'category', 'foreign': 'int64', 'trust': 'int64', 'dealer': 'int64', 'foreign_streak': 'int16'})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fill the institutional flow store and rebuild the foreign buying streaks')
+    parser.add_argument('--backfill', type=int, default=STREAK_MAX_DAYS, help='trading days to download before the date')
+    parser.add_argument('--date', default=datetime.now().strftime('%Y%m%d'), help='last trading date (YYYYMMDD)')
+    args = parser.parse_args()
+
+    last_date = datetime.strptime(args.date, '%Y%m%d')
+    # Start from scratch so the streaks cover the whole backfill
+    _execute('DELETE FROM streak_state')
+    table = get_streak_table(last_date, args.backfill)
+    if table is None:
+        logger.error("Backfill incomplete, run it again to retry the missing days.")
+    else:
+        logger.info(f"Backfilled {args.backfill} trading days, {int((table['foreign_streak'] > 0).sum())} stocks on a foreign buying streak.")
@@ -1,24 +1,99 @@
 # logger_config.py
+import atexit
+import copy
+import json
 import logging
-from logging.handlers import TimedRotatingFileHandler
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from datetime import datetime
 
+# Log file next to the scripts (not the working directory of cron or the daemon), TWSR_LOG_FILE points elsewhere
+LOG_FILE = os.environ.get('TWSR_LOG_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reporter.log')
+
+# Fields passed with extra={...} that are written to the JSON lines
+EXTRA_FIELDS = ('symbol', 'market', 'url', 'latency', 'outcome')
+
+# Share of debug records kept, TWSR_DEBUG_SAMPLE or "log_debug_sample" in config.json (0 turns debug logging off)
+DEFAULT_DEBUG_SAMPLE = float(os.environ.get('TWSR_DEBUG_SAMPLE', 0))
+
+_listener = None
+
+# Formatter writing one JSON object per line
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        # The traceback is formatted by StructuredQueueHandler in the logging thread, kept apart from the message
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+# Queue handler keeping the traceback out of the message
+# QueueHandler.prepare folds it into the message and drops exc_info, here it is formatted into exc_text instead,
+# which the console formatter appends and JsonFormatter writes to its own field
+class StructuredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+# Filter keeping a random share of the debug records, other levels always pass
+class DebugSampler(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+# Function to set the share of debug records kept (0 to 1)
+def set_debug_sample(rate):
+    logger = setup_logger()
+    for log_filter in logger.handlers[0].filters:
+        if isinstance(log_filter, DebugSampler):
+            log_filter.rate = rate
+    logger.setLevel(logging.DEBUG if rate > 0 else logging.INFO)
+
 def setup_logger():
     logger = logging.getLogger(__name__)
-    logger.setLevel(logging.INFO)
-
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
     # Add handlers only if not already added
     if not logger.handlers:
+        logger.setLevel(logging.DEBUG if DEFAULT_DEBUG_SAMPLE > 0 else logging.INFO)
+
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.DEBUG)
-        console_handler.setFormatter(formatter)
+        console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+        file_handler = TimedRotatingFileHandler(LOG_FILE, when='midnight', interval=1, backupCount=7, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
 
-        file_handler = TimedRotatingFileHandler('reporter.log', when='midnight', interval=1, backupCount=7)
-        file_handler.setFormatter(formatter)
+        # Callers only put records on a queue, a listener thread does the formatting and the blocking writes
+        log_queue = queue.SimpleQueue()
+        queue_handler = StructuredQueueHandler(log_queue)
+        queue_handler.addFilter(DebugSampler(DEFAULT_DEBUG_SAMPLE))
+        logger.addHandler(queue_handler)
 
-        logger.addHandler(console_handler)
-        logger.addHandler(file_handler)
+        global _listener
+        _listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+        _listener.start()
+        # Drain the queue before the interpreter exits
+        atexit.register(_listener.stop)
 
-    return logger
\ No newline at end of file
+    return logger
@@ -0,0 +1,77 @@
+import gc
+import os
+import resource
+import threading
+
+import metrics
+from logger_config import setup_logger
+
+# Set up the logger
+logger = setup_logger()
+
+# Stocks (or trading days) fetched between two memory checks
+DEFAULT_CHUNK_SIZE = 100
+
+_budget_mb = None
+_chunk_size = DEFAULT_CHUNK_SIZE
+# Functions dropping in-memory caches, called when the budget is exceeded
+_releasers = []
+_lock = threading.Lock()
+
+# Function to apply "memory_budget_mb" and "memory_chunk_size" from the properties, no budget leaves memory unbounded
+def configure(properties):
+    global _budget_mb, _chunk_size
+    _budget_mb = properties.get('memory_budget_mb')
+    _chunk_size = properties.get('memory_chunk_size', DEFAULT_CHUNK_SIZE)
+
+def get_budget_mb():
+    return _budget_mb
+
+def get_chunk_size():
+    return _chunk_size
+
+# Function to get the peak resident set size of the process in MB (ru_maxrss is in KB on Linux)
+def get_peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Function to get the current resident set size of the process in MB, the peak where /proc isn't available
+def get_rss_mb():
+    try:
+        with open('/proc/self/statm') as file:
+            resident_pages = int(file.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return get_peak_rss_mb()
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+# Function to register a function that drops an in-memory cache when the budget is exceeded
+def register_releaser(release):
+    with _lock:
+        _releasers.append(release)
+
+# Function to check the memory after a stage of the run, records the RSS in the run summary
+# Over the budget the registered caches are dropped and garbage collected; returns False if still over it
+def check(stage):
+    rss_mb = get_rss_mb()
+    metrics.record_memory(stage, rss_mb)
+    if _budget_mb is None or rss_mb <= _budget_mb:
+        return True
+
+    logger.warning(f"Memory over budget after {stage}: {rss_mb:.0f} MB of {_budget_mb} MB, releasing caches")
+    with _lock:
+        releasers = list(_releasers)
+    for release in releasers:
+        release()
+    gc.collect()
+
+    rss_mb = get_rss_mb()
+    metrics.record_memory(stage, rss_mb)
+    if rss_mb > _budget_mb:
+        logger.warning(f"Memory still over budget after {stage}: {rss_mb:.0f} MB")
+        return False
+    return True
+
+# Function to cap a worker count to the processes that fit in the budget, each assumed as large as this one
+def cap_workers(workers):
+    if _budget_mb is None:
+        return workers
+    return max(1, min(workers, int(_budget_mb // max(get_rss_mb(), 1))))
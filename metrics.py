@@ -0,0 +1,185 @@
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from data_paths import get_data_path
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_started_at = time.time()
+_hosts = {}
+_phases = {}
+_cache = {}
+_memory = {}
+
+def _host_metrics(host):
+    if host not in _hosts:
+        _hosts[host] = {
+            'requests': {},
+            'retries': 0,
+            'response_bytes': 0,
+            'request_bytes': 0,
+            'wait_seconds': 0.0,
+            'latency_buckets': [0] * len(LATENCY_BUCKETS),
+            'latency_count': 0,
+            'latency_sum': 0.0,
+        }
+    return _hosts[host]
+
+# Function to start a new run, drops everything recorded so far
+def reset():
+    global _started_at
+    with _lock:
+        _started_at = time.time()
+        _hosts.clear()
+        _phases.clear()
+        _cache.clear()
+        _memory.clear()
+
+# Function to record one HTTP request, outcome is the status code or "error"
+def record_request(host, outcome, latency, response_bytes=0, request_bytes=0, retries=0):
+    with _lock:
+        metrics = _host_metrics(host)
+        outcome = str(outcome)
+        metrics['requests'][outcome] = metrics['requests'].get(outcome, 0) + 1
+        metrics['retries'] += retries
+        metrics['response_bytes'] += response_bytes
+        metrics['request_bytes'] += request_bytes
+        metrics['latency_count'] += 1
+        metrics['latency_sum'] += latency
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                metrics['latency_buckets'][i] += 1
+
+# Function to record time spent waiting for a host's request budget
+def record_wait(host, seconds):
+    if seconds <= 0:
+        return
+    with _lock:
+        _host_metrics(host)['wait_seconds'] += seconds
+
+# Function to record one lookup of the HTTP cache, outcome is "memory_hit", "disk_hit" or "miss"
+def record_cache(outcome):
+    with _lock:
+        _cache[outcome] = _cache.get(outcome, 0) + 1
+
+# Function to record the resident set size (MB) after a stage of the run, the largest value per stage is kept
+def record_memory(stage, rss_mb):
+    with _lock:
+        _memory[stage] = max(_memory.get(stage, 0.0), rss_mb)
+
+# Context manager to time a phase of the run, repeated phases add up
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _phases[name] = _phases.get(name, 0.0) + time.perf_counter() - started
+
+# Function to build the run summary as a plain dict
+def get_summary(report):
+    with _lock:
+        return {
+            'report': report,
+            'started_at': datetime.fromtimestamp(_started_at).isoformat(timespec='seconds'),
+            'duration_seconds': round(time.time() - _started_at, 3),
+            'phases': {name: round(seconds, 3) for name, seconds in _phases.items()},
+            'hosts': json.loads(json.dumps(_hosts)),
+            'cache': dict(_cache),
+            # ru_maxrss is in KB on Linux, the peak of the whole process (the daemon runs several reports)
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'rss_mb': {stage: round(rss_mb, 1) for stage, rss_mb in _memory.items()},
+            'latency_buckets': list(LATENCY_BUCKETS),
+        }
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+# Function to render the run summary in the Prometheus text exposition format
+def to_prometheus(summary):
+    report = summary['report']
+    lines = [
+        '# HELP twsr_run_duration_seconds Wall time of the last run.',
+        '# TYPE twsr_run_duration_seconds gauge',
+        f"twsr_run_duration_seconds{_labels(report=report)} {summary['duration_seconds']}",
+        '# HELP twsr_last_run_timestamp_seconds Start time of the last run.',
+        '# TYPE twsr_last_run_timestamp_seconds gauge',
+        f"twsr_last_run_timestamp_seconds{_labels(report=report)} {int(_started_at)}",
+        '# HELP twsr_phase_duration_seconds Wall time spent in each phase of the last run.',
+        '# TYPE twsr_phase_duration_seconds gauge',
+    ]
+    for name, seconds in summary['phases'].items():
+        lines.append(f'twsr_phase_duration_seconds{_labels(report=report, phase=name)} {seconds}')
+
+    lines += [
+        '# HELP twsr_peak_rss_bytes Peak resident set size of the process.',
+        '# TYPE twsr_peak_rss_bytes gauge',
+        f"twsr_peak_rss_bytes{_labels(report=report)} {int(summary['peak_rss_mb'] * 1024 * 1024)}",
+        '# HELP twsr_rss_bytes Resident set size after each stage of the last run.',
+        '# TYPE twsr_rss_bytes gauge',
+    ]
+    for stage, rss_mb in summary['rss_mb'].items():
+        lines.append(f'twsr_rss_bytes{_labels(report=report, stage=stage)} {int(rss_mb * 1024 * 1024)}')
+
+    lines += [
+        '# HELP twsr_http_cache_lookups HTTP cache lookups of the last run by outcome.',
+        '# TYPE twsr_http_cache_lookups gauge',
+    ]
+    for outcome, count in summary['cache'].items():
+        lines.append(f'twsr_http_cache_lookups{_labels(report=report, outcome=outcome)} {count}')
+
+    lines += [
+        '# HELP twsr_http_requests HTTP requests of the last run by host and outcome.',
+        '# TYPE twsr_http_requests gauge',
+    ]
+    for host, metrics in summary['hosts'].items():
+        for outcome, count in metrics['requests'].items():
+            lines.append(f'twsr_http_requests{_labels(report=report, host=host, outcome=outcome)} {count}')
+
+    for name, key, help_text in (
+        ('twsr_http_retries', 'retries', 'Retries of the last run by host.'),
+        ('twsr_http_response_bytes', 'response_bytes', 'Response bytes of the last run by host.'),
+        ('twsr_http_request_bytes', 'request_bytes', 'Request body bytes of the last run by host.'),
+        ('twsr_rate_limit_wait_seconds', 'wait_seconds', 'Seconds spent waiting for the request budget of the last run by host.'),
+    ):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        for host, metrics in summary['hosts'].items():
+            lines.append(f'{name}{_labels(report=report, host=host)} {metrics[key]}')
+
+    lines += [
+        '# HELP twsr_http_request_duration_seconds HTTP request latency of the last run by host.',
+        '# TYPE twsr_http_request_duration_seconds histogram',
+    ]
+    for host, metrics in summary['hosts'].items():
+        for bound, count in zip(LATENCY_BUCKETS, metrics['latency_buckets']):
+            lines.append(f'twsr_http_request_duration_seconds_bucket{_labels(report=report, host=host, le=bound)} {count}')
+        lines.append(f"twsr_http_request_duration_seconds_bucket{_labels(report=report, host=host, le='+Inf')} {metrics['latency_count']}")
+        lines.append(f"twsr_http_request_duration_seconds_sum{_labels(report=report, host=host)} {round(metrics['latency_sum'], 6)}")
+        lines.append(f"twsr_http_request_duration_seconds_count{_labels(report=report, host=host)} {metrics['latency_count']}")
+    return '\n'.join(lines) + '\n'
+
+# Function to write the run summary to data/run_summary_<report>.json and, when "metrics_textfile_dir" is configured,
+# a Prometheus textfile for node_exporter's textfile collector
+def export(report, properties):
+    summary = get_summary(report)
+
+    with open(get_data_path(f'run_summary_{report}.json'), 'w') as file:
+        json.dump(summary, file, indent=4)
+
+    textfile_dir = properties.get('metrics_textfile_dir')
+    if textfile_dir:
+        # Write to a temporary file and rename so node_exporter never reads a partial file
+        textfile_path = os.path.join(textfile_dir, f'twsr_{report}.prom')
+        temp_path = textfile_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(to_prometheus(summary))
+        os.replace(temp_path, textfile_path)
+    return summary
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+# Lookback windows (trading records) of the return and moving average features
+DEFAULT_WINDOWS = (5, 10, 20, 60)
+
+# Trading records used by the volume ratio and volatility features
+VOLUME_WINDOW = 20
+VOLATILITY_WINDOW = 20
+
+# Quote matrices hold float32, half the memory of float64 and precise enough for closes and volumes
+QUOTE_DTYPE = 'float32'
+
+# Function to compute the feature vector of every stock from date x stock_number matrices ending at the evaluation date
+# Columns: close, return_<n>d (percent change over n records), ma_<n>, volume_ratio (last volume / average of the
+# previous VOLUME_WINDOW), volatility_<n>d (standard deviation of daily percent returns). Missing history gives NaN.
+def compute_features(close_matrix, volume_matrix=None, windows=DEFAULT_WINDOWS):
+    closes = close_matrix.to_numpy(dtype=float)
+    n_rows = closes.shape[0]
+    nan_column = np.full(closes.shape[1], np.nan)
+    latest = closes[-1] if n_rows else nan_column
+
+    features = {'close': latest}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for window in windows:
+            if n_rows > window:
+                earlier = closes[-1 - window]
+                features[f'return_{window}d'] = np.round(np.where(earlier > 0, (latest - earlier) / earlier * 100, np.nan), 2)
+            else:
+                features[f'return_{window}d'] = nan_column
+            features[f'ma_{window}'] = np.round(closes[-window:].mean(axis=0), 2) if n_rows >= window else nan_column
+
+        if n_rows > VOLATILITY_WINDOW:
+            recent = closes[-VOLATILITY_WINDOW - 1:]
+            daily_returns = np.diff(recent, axis=0) / recent[:-1] * 100
+            features[f'volatility_{VOLATILITY_WINDOW}d'] = np.round(daily_returns.std(axis=0, ddof=1), 2)
+        else:
+            features[f'volatility_{VOLATILITY_WINDOW}d'] = nan_column
+
+        if volume_matrix is not None and volume_matrix.shape[0] > VOLUME_WINDOW:
+            volumes = volume_matrix.reindex(columns=close_matrix.columns).to_numpy(dtype=float)
+            average_volume = volumes[-VOLUME_WINDOW - 1:-1].mean(axis=0)
+            features['volume_ratio'] = np.round(np.where(average_volume > 0, volumes[-1] / average_volume, np.nan), 2)
+        else:
+            features['volume_ratio'] = nan_column
+
+    return pd.DataFrame(features, index=pd.Index(close_matrix.columns, name='stock_number'))
+
+# Function to list the columns compute_features returns for the windows
+def feature_columns(windows=DEFAULT_WINDOWS):
+    columns = ['close']
+    for window in windows:
+        columns += [f'return_{window}d', f'ma_{window}']
+    return columns + [f'volatility_{VOLATILITY_WINDOW}d', 'volume_ratio']
+
+# Function to build the matrices compute_features expects from per-stock histories ({stock_number: history frame})
+# Each stock's records are aligned by position from its latest one, not by date, so a day missing from one stock's
+# history doesn't blank its features. Histories without a record on end_date are left empty (NaN features).
+def histories_to_matrices(histories, end_date):
+    available = {stock_number: history for stock_number, history in histories.items()
+                 if history is not None and not history.empty and history.index[-1] == end_date}
+    n_rows = max((len(history) for history in available.values()), default=0)
+
+    def aligned(column):
+        return pd.DataFrame({stock_number: np.concatenate([np.full(n_rows - len(history), np.nan), history[column].to_numpy(dtype=float)])
+                             for stock_number, history in available.items()}, index=pd.RangeIndex(1 - n_rows, 1, name='offset'))
+
+    return (aligned('close').reindex(columns=list(histories)).astype(QUOTE_DTYPE),
+            aligned('volume').reindex(columns=list(histories)).astype(QUOTE_DTYPE))
+
+# Function to keep only what the features need of a price history: float32 close and volume
+def slim_history(history):
+    if history is None:
+        return None
+    return history[['close', 'volume']].astype(QUOTE_DTYPE)
+
+# Function to extend a close/volume history by one day's quote, keeping the last n_records + 1 records
+def append_quote(history, day, close, volume, n_records):
+    row = pd.DataFrame({'close': [close], 'volume': [volume]}, index=pd.DatetimeIndex([day], name='date'))
+    history = pd.concat([history[history.index < day], row]).astype(QUOTE_DTYPE)
+    return history.iloc[-(n_records + 1):]
+
+# Function to convert one day's quotes ({stock_number: [close, volume]}) to float32 close and volume Series
+# Callers keep the Series instead of the dict, which holds a list and two boxed floats per stock
+def quotes_to_series(quotes):
+    stock_numbers = list(quotes)
+    close = pd.Series([quote[0] for quote in quotes.values()], index=stock_numbers, dtype=QUOTE_DTYPE)
+    volume = pd.Series([quote[1] for quote in quotes.values()], index=stock_numbers, dtype=QUOTE_DTYPE)
+    return close, volume
+
+# Function to stack per-day Series ({date: (close, volume)}) into date x stock_number matrices, oldest first
+def series_to_matrices(rows):
+    dates = sorted(rows)
+    close_matrix = pd.DataFrame([rows[day][0] for day in dates], index=dates).astype(QUOTE_DTYPE)
+    volume_matrix = pd.DataFrame([rows[day][1] for day in dates], index=dates).astype(QUOTE_DTYPE)
+    return close_matrix, volume_matrix
@@ -0,0 +1,101 @@
+import json
+import sqlite3
+from datetime import datetime
+
+from data_paths import get_data_path
+
+DB_FILENAME = 'price_history.db'
+
+# Function to open the price history database, creating the schema if needed
+def _connect():
+    conn = sqlite3.connect(get_data_path(DB_FILENAME))
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_prices (
+            market TEXT NOT NULL,
+            stock_number TEXT NOT NULL,
+            month TEXT NOT NULL,
+            fields TEXT,
+            rows TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (market, stock_number, month)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_snapshots (
+            market TEXT NOT NULL,
+            trade_date TEXT NOT NULL,
+            trading INTEGER NOT NULL,
+            closes TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (market, trade_date)
+        )
+    ''')
+    return conn
+
+def _month_key(date_time: datetime):
+    return date_time.strftime('%Y%m')
+
+# Function to check if a month is over, i.e. its daily records will never change again
+def is_closed_month(date_time: datetime):
+    now = datetime.now()
+    return (date_time.year, date_time.month) < (now.year, now.month)
+
+# Function to load the daily records of a month, returns (fields, rows) or None if not stored
+def load_month(market, stock_number, date_time: datetime):
+    conn = _connect()
+    try:
+        row = conn.execute(
+            'SELECT fields, rows FROM monthly_prices WHERE market = ? AND stock_number = ? AND month = ?',
+            (market, stock_number, _month_key(date_time))
+        ).fetchone()
+    finally:
+        conn.close()
+
+    if row is None:
+        return None
+    fields = json.loads(row[0]) if row[0] is not None else None
+    return fields, json.loads(row[1])
+
+# Function to save the daily records of a month
+def save_month(market, stock_number, date_time: datetime, rows, fields=None):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO monthly_prices (market, stock_number, month, fields, rows, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (market, stock_number, _month_key(date_time),
+                 json.dumps(fields) if fields is not None else None,
+                 json.dumps(rows, ensure_ascii=False),
+                 datetime.now().isoformat(timespec='seconds'))
+            )
+    finally:
+        conn.close()
+
+# Function to load an all-market snapshot, returns {stock_number: [close, volume]} or None if not stored
+# An empty dict means the date is stored as a non-trading day
+def load_snapshot(market, date_time: datetime):
+    conn = _connect()
+    try:
+        row = conn.execute(
+            'SELECT trading, closes FROM daily_snapshots WHERE market = ? AND trade_date = ?',
+            (market, date_time.strftime('%Y%m%d'))
+        ).fetchone()
+    finally:
+        conn.close()
+
+    if row is None:
+        return None
+    return json.loads(row[1]) if row[0] else {}
+
+# Function to save an all-market snapshot, an empty dict marks a non-trading day
+def save_snapshot(market, date_time: datetime, quotes):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO daily_snapshots (market, trade_date, trading, closes, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (market, date_time.strftime('%Y%m%d'), 1 if quotes else 0,
+                 json.dumps(quotes), datetime.now().isoformat(timespec='seconds'))
+            )
+    finally:
+        conn.close()
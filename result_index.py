@@ -0,0 +1,143 @@
+import json
+import math
+import sqlite3
+
+import pandas as pd
+
+from data_paths import get_data_path
+
+DB_FILENAME = 'result_index.db'
+
+MAX_QUERY_PARAMETERS = 500
+
+# Function to open the result index, creating the schema if needed
+# Unlike the run journal it is never reset: every trade date's evaluations and result sets are kept
+def _connect():
+    conn = sqlite3.connect(get_data_path(DB_FILENAME), timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS evaluations (
+            trade_date TEXT NOT NULL,
+            stock_number TEXT NOT NULL,
+            streak INTEGER,
+            close REAL,
+            features TEXT NOT NULL,
+            PRIMARY KEY (trade_date, stock_number)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS evaluations_by_stock ON evaluations (stock_number, trade_date)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS result_sets (
+            trade_date TEXT NOT NULL,
+            screen TEXT NOT NULL,
+            stock_number TEXT NOT NULL,
+            PRIMARY KEY (trade_date, screen, stock_number)
+        )
+    ''')
+    # One row per screen and date, so a day on which no stock passed still counts as a result set
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS screen_runs (
+            trade_date TEXT NOT NULL,
+            screen TEXT NOT NULL,
+            PRIMARY KEY (screen, trade_date)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS histories (
+            stock_number TEXT PRIMARY KEY,
+            as_of TEXT NOT NULL,
+            history TEXT NOT NULL
+        )
+    ''')
+    return conn
+
+def _execute(statement, parameters=()):
+    conn = _connect()
+    try:
+        with conn:
+            return conn.execute(statement, parameters).fetchall()
+    finally:
+        conn.close()
+
+def _to_float(value):
+    return None if value is None or math.isnan(float(value)) else float(value)
+
+# Function to save the feature vector of every evaluated stock of a trade date
+# features is indexed by stock number, streaks maps stock numbers to their foreign buying streak
+def save_evaluations(trade_date, features, streaks):
+    rows = []
+    for stock_number, row in zip(features.index, features.to_dict('records')):
+        values = {column: _to_float(value) for column, value in row.items()}
+        streak = _to_float(streaks.get(stock_number))
+        rows.append((trade_date, stock_number, int(streak) if streak is not None else None, values.get('close'), json.dumps(values)))
+
+    conn = _connect()
+    try:
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO evaluations (trade_date, stock_number, streak, close, features) VALUES (?, ?, ?, ?, ?)', rows)
+    finally:
+        conn.close()
+
+# Function to load the evaluations of a trade date as a DataFrame indexed by stock number (empty if none)
+def load_evaluations(trade_date):
+    rows = _execute('SELECT stock_number, features FROM evaluations WHERE trade_date = ?', (trade_date,))
+    return pd.DataFrame([json.loads(features) for _, features in rows],
+                        index=pd.Index([stock_number for stock_number, _ in rows], name='stock_number'), dtype=float)
+
+# Function to replace the stocks that passed a screen on a trade date
+def save_result_set(trade_date, screen, stock_numbers):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO screen_runs (trade_date, screen) VALUES (?, ?)', (trade_date, screen))
+            conn.execute('DELETE FROM result_sets WHERE trade_date = ? AND screen = ?', (trade_date, screen))
+            conn.executemany('INSERT OR REPLACE INTO result_sets (trade_date, screen, stock_number) VALUES (?, ?, ?)',
+                             [(trade_date, screen, stock_number) for stock_number in stock_numbers])
+    finally:
+        conn.close()
+
+# Function to load the latest result set of a screen before a trade date, returns (trade_date, set of stock numbers) or (None, None)
+def load_previous_result_set(trade_date, screen):
+    rows = _execute('SELECT MAX(trade_date) FROM screen_runs WHERE screen = ? AND trade_date < ?', (screen, trade_date))
+    previous_date = rows[0][0] if rows else None
+    if previous_date is None:
+        return None, None
+    rows = _execute('SELECT stock_number FROM result_sets WHERE trade_date = ? AND screen = ?', (previous_date, screen))
+    return previous_date, {stock_number for stock_number, in rows}
+
+# Function to compare a screen's stocks of a trade date with its previous result set
+# Returns {'previous_date', 'entered', 'exited', 'unchanged'} with the stocks in report order, or None without a previous set
+def get_deltas(trade_date, screen, stock_numbers):
+    previous_date, previous = load_previous_result_set(trade_date, screen)
+    if previous_date is None:
+        return None
+    current = set(stock_numbers)
+    return {
+        'previous_date': previous_date,
+        'entered': [stock_number for stock_number in stock_numbers if stock_number not in previous],
+        'exited': sorted(previous - current),
+        'unchanged': [stock_number for stock_number in stock_numbers if stock_number in previous],
+    }
+
+# Function to save the latest close/volume history of stocks as of a trade date ({stock_number: history frame})
+def save_histories(trade_date, histories):
+    rows = [(stock_number, trade_date, history.to_json(orient='split', date_format='iso'))
+            for stock_number, history in histories.items() if history is not None and not history.empty]
+    conn = _connect()
+    try:
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO histories (stock_number, as_of, history) VALUES (?, ?, ?)', rows)
+    finally:
+        conn.close()
+
+# Function to load the stored histories of stocks as {stock_number: (as_of, history frame)}, stocks without one are left out
+def load_histories(stock_numbers):
+    stock_numbers = list(stock_numbers)
+    histories = {}
+    # SQLite limits the number of parameters of a statement
+    for start in range(0, len(stock_numbers), MAX_QUERY_PARAMETERS):
+        chunk = stock_numbers[start:start + MAX_QUERY_PARAMETERS]
+        rows = _execute(f"SELECT stock_number, as_of, history FROM histories WHERE stock_number IN ({', '.join('?' * len(chunk))})", chunk)
+        for stock_number, as_of, history in rows:
+            payload = json.loads(history)
+            histories[stock_number] = (as_of, pd.DataFrame(payload['data'], columns=payload['columns'], index=pd.DatetimeIndex(payload['index'], name='date')))
+    return histories
@@ -0,0 +1,106 @@
+import json
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+from data_paths import get_data_path
+
+DB_FILENAME = 'run_journal.db'
+
+# Function to open the run journal, creating the schema if needed
+# Workers write concurrently, so wait for locks instead of failing
+def _connect():
+    conn = sqlite3.connect(get_data_path(DB_FILENAME), timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS candidates (
+            trade_date TEXT PRIMARY KEY,
+            payload TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS histories (
+            trade_date TEXT NOT NULL,
+            stock_number TEXT NOT NULL,
+            history TEXT,
+            PRIMARY KEY (trade_date, stock_number)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS queued_reports (
+            trade_date TEXT NOT NULL,
+            screen TEXT NOT NULL,
+            queued_at TEXT NOT NULL,
+            PRIMARY KEY (trade_date, screen)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS runs (
+            trade_date TEXT PRIMARY KEY,
+            completed_at TEXT NOT NULL
+        )
+    ''')
+    return conn
+
+def _execute(statement, parameters=()):
+    conn = _connect()
+    try:
+        with conn:
+            return conn.execute(statement, parameters).fetchall()
+    finally:
+        conn.close()
+
+# Function to drop everything journaled for a trade date, used when a run starts without --resume
+def reset(trade_date):
+    conn = _connect()
+    try:
+        with conn:
+            for table in ('candidates', 'histories', 'queued_reports', 'runs'):
+                conn.execute(f'DELETE FROM {table} WHERE trade_date = ?', (trade_date,))
+    finally:
+        conn.close()
+
+# Function to save the candidate list of a trade date
+def save_candidates(trade_date, df):
+    _execute('INSERT OR REPLACE INTO candidates (trade_date, payload) VALUES (?, ?)', (trade_date, df.to_json(orient='split', force_ascii=False)))
+
+# Function to load the candidate list of a trade date, returns None if not journaled
+def load_candidates(trade_date):
+    rows = _execute('SELECT payload FROM candidates WHERE trade_date = ?', (trade_date,))
+    if not rows:
+        return None
+    payload = json.loads(rows[0][0])
+    return pd.DataFrame(payload['data'], columns=payload['columns'])
+
+# Function to save the price history fetched for a stock, None records that no data was available
+def save_history(trade_date, stock_number, history):
+    _execute('INSERT OR REPLACE INTO histories (trade_date, stock_number, history) VALUES (?, ?, ?)',
+             (trade_date, stock_number, history.to_json(orient='split', date_format='iso') if history is not None else None))
+
+# Function to load all price histories journaled for a trade date as {stock_number: history frame or None}
+def load_histories(trade_date):
+    rows = _execute('SELECT stock_number, history FROM histories WHERE trade_date = ?', (trade_date,))
+    histories = {}
+    for stock_number, history in rows:
+        if history is None:
+            histories[stock_number] = None
+            continue
+        payload = json.loads(history)
+        histories[stock_number] = pd.DataFrame(payload['data'], columns=payload['columns'], index=pd.DatetimeIndex(payload['index'], name='date'))
+    return histories
+
+# Function to record that the report of a screen was handed to the Discord outbox
+def mark_queued(trade_date, screen):
+    _execute('INSERT OR REPLACE INTO queued_reports (trade_date, screen, queued_at) VALUES (?, ?, ?)', (trade_date, screen, datetime.now().isoformat(timespec='seconds')))
+
+# Function to load the names of the screens already queued for a trade date
+def load_queued(trade_date):
+    return {screen for screen, in _execute('SELECT screen FROM queued_reports WHERE trade_date = ?', (trade_date,))}
+
+# Function to mark the run of a trade date as completed (report delivered)
+def mark_completed(trade_date):
+    _execute('INSERT OR REPLACE INTO runs (trade_date, completed_at) VALUES (?, ?)', (trade_date, datetime.now().isoformat(timespec='seconds')))
+
+# Function to check if the run of a trade date was completed
+def is_completed(trade_date):
+    return bool(_execute('SELECT 1 FROM runs WHERE trade_date = ?', (trade_date,)))
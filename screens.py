@@ -0,0 +1,112 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from momentum import DEFAULT_WINDOWS, VOLATILITY_WINDOW
+
+# Screen used when config.json has no "screens", the original hardcoded report
+DEFAULT_SCREEN = {
+    'name': 'hp_stock_data',
+    'rules': {'return_9d': {'min': -20.0, 'max': 5.0}},
+}
+
+# Column of the stock list holding the number of consecutive foreign buying days
+CONT_BUY_DAYS_COLUMN = '外資連續買賣日數'
+
+# Stocks named per change in the Discord message, longer lists are cut short
+MAX_LISTED_CHANGES = 20
+
+_WINDOW_FEATURE = re.compile(r'^(return_(\d+)d|ma_(\d+))$')
+_FIXED_FEATURES = ('close', f'volatility_{VOLATILITY_WINDOW}d', 'volume_ratio')
+
+# Function to read the screens declared in the properties, e.g.
+# "screens": [{"name": "pullback", "min_cont_buy_days": 5, "rules": {"return_9d": {"min": -5, "max": 10}}}]
+# Screens without "min_cont_buy_days" use the top-level value (default 5)
+def load_screens(properties):
+    default_min_days = properties.get('min_cont_buy_days', 5)
+    screens = []
+    for screen in properties.get('screens') or [DEFAULT_SCREEN]:
+        name = screen.get('name')
+        if not name or not re.match(r'^[\w-]+$', name):
+            raise ValueError(f"Screen name must be letters, digits, '_' or '-': {name!r}")
+        if name in [existing['name'] for existing in screens]:
+            raise ValueError(f"Duplicate screen name: {name}")
+
+        rules = screen.get('rules', {})
+        for feature, bounds in rules.items():
+            if not _WINDOW_FEATURE.match(feature) and feature not in _FIXED_FEATURES:
+                raise ValueError(f"Unknown feature in screen {name}: {feature}")
+            if not set(bounds) <= {'min', 'max'}:
+                raise ValueError(f"Rule bounds must be 'min' and/or 'max', screen: {name} feature: {feature}")
+
+        screens.append({
+            'name': name,
+            'min_cont_buy_days': screen.get('min_cont_buy_days', default_min_days),
+            'rules': rules,
+            'message': screen.get('message'),
+        })
+    return screens
+
+# Function to get the feature windows needed by all screens, the momentum defaults are always included for the report
+def get_feature_windows(screens):
+    windows = set(DEFAULT_WINDOWS)
+    for screen in screens:
+        for feature in screen['rules']:
+            match = _WINDOW_FEATURE.match(feature)
+            if match:
+                windows.add(int(match.group(2) or match.group(3)))
+    return tuple(sorted(windows))
+
+# Function to get the smallest buying streak of all screens, stocks below it are not candidates of any screen
+def get_min_cont_buy_days(screens):
+    return min(screen['min_cont_buy_days'] for screen in screens)
+
+# Function to evaluate every screen as a boolean mask over the shared candidate table
+# df holds the stock list joined with its features, one row per candidate; NaN features fail every rule
+def evaluate(df, screens):
+    cont_buy_days = pd.to_numeric(df[CONT_BUY_DAYS_COLUMN], errors='coerce').to_numpy(dtype=float)
+    masks = {}
+    with np.errstate(invalid='ignore'):
+        for screen in screens:
+            mask = cont_buy_days >= screen['min_cont_buy_days']
+            for feature, bounds in screen['rules'].items():
+                values = df[feature].to_numpy(dtype=float)
+                if 'min' in bounds:
+                    mask &= values >= bounds['min']
+                if 'max' in bounds:
+                    mask &= values <= bounds['max']
+            masks[screen['name']] = mask
+    return masks
+
+def _describe_rule(feature, bounds):
+    match = _WINDOW_FEATURE.match(feature)
+    low = f"{bounds['min']:g}%" if 'min' in bounds else ''
+    high = f"{bounds['max']:g}%" if 'max' in bounds else ''
+    if match and match.group(2):
+        # n records back spans n + 1 trading days
+        return f"{int(match.group(2)) + 1}日漲跌幅區間:{low} ~ {high}"
+    return f"{feature}:{bounds.get('min', '')} ~ {bounds.get('max', '')}"
+
+# Function to build the Discord message of a screen, "message" in the config overrides it
+def describe(screen):
+    if screen['message']:
+        return screen['message']
+    parts = [f"外資連續{screen['min_cont_buy_days']}日以上買超"]
+    parts += [_describe_rule(feature, bounds) for feature, bounds in screen['rules'].items()]
+    return ', '.join(parts)
+
+def _list_stocks(stock_numbers):
+    listed = ', '.join(stock_numbers[:MAX_LISTED_CHANGES])
+    if len(stock_numbers) > MAX_LISTED_CHANGES:
+        listed += f' 等{len(stock_numbers)}檔'
+    return listed
+
+# Function to describe a screen's changes since its previous result set (result_index.get_deltas) for the Discord message
+def describe_deltas(deltas):
+    lines = [f"較{deltas['previous_date']}: 新進{len(deltas['entered'])}檔, 移出{len(deltas['exited'])}檔, 持續{len(deltas['unchanged'])}檔"]
+    if deltas['entered']:
+        lines.append('新進: ' + _list_stocks(deltas['entered']))
+    if deltas['exited']:
+        lines.append('移出: ' + _list_stocks(deltas['exited']))
+    return '\n'.join(lines)
@@ -1,8 +1,14 @@
 import requests
-import time
+import pandas as pd
 from datetime import datetime, timedelta
 from urllib.parse import quote
 
+import fetch_scheduler
+import http_cache
+import price_store
+import stock_listing
+import trading_calendar
+from momentum import quotes_to_series, series_to_matrices
 from logger_config import setup_logger
 
 # Set up the logger
@@ -16,122 +22,61 @@ class StockPriceDifference:
         self.earlier_closing_price = earlier_closing_price
 
 def fetch_data(url):
-    logger.debug(f"Fetching: {url}")
+    logger.debug(f"Fetching: {url}", extra={'url': url})
     try:
-        response = requests.get(url)
+        # Served from the HTTP cache when possible, otherwise the shared client waits for the host's request budget and retries transient failures
+        response = http_cache.get(url, validate=lambda response: response.json() is not None)
         response.raise_for_status()  # Raises an HTTPError for bad responses
         return response.json()
     except requests.exceptions.HTTPError as errh:
-        logger.error(f"HTTP Error: {errh}")
+        logger.error(f"HTTP Error: {errh}", extra={'url': url})
     except requests.exceptions.ConnectionError as errc:
-        logger.error(f"Error Connecting: {errc}")
+        logger.error(f"Error Connecting: {errc}", extra={'url': url})
     except requests.exceptions.Timeout as errt:
-        logger.error(f"Timeout Error: {errt}")
+        logger.error(f"Timeout Error: {errt}", extra={'url': url})
     except requests.exceptions.RequestException as err:
-        logger.error(f"Error: {err}")
+        logger.error(f"Error: {err}", extra={'url': url})
     return None
 
-def get_stock_price_difference(stock_number, date_time, n_records):
-    # Parse input date_time to extract the first day of the month
-    input_date = datetime.strptime(date_time, '%Y%m%d')
-    first_day_of_month = input_date.replace(day=1)
+# Function to get one month of TWSE daily records, returns (fields, rows), no rows if the stock has none that month, or None if the request failed
+# Closed months are served from the local price store and only fetched once
+def fetch_twse_month(stock_number, first_day_of_month):
+    stored = price_store.load_month('TWSE', stock_number, first_day_of_month)
+    if stored is not None:
+        return stored
 
-    # Format the first day of the month for the URL
     formatted_date = first_day_of_month.strftime('%Y%m%d')
-
-    # Construct the URL for fetching data
     url = f'https://www.twse.com.tw/rwd/en/afterTrading/STOCK_DAY?date={formatted_date}&stockNo={stock_number}&response=json'
+    data = fetch_data(url)
+
+    if data is None:
+        return None
+    if data.get('stat') != 'OK':
+        return data.get('fields', []), []
+
+    if price_store.is_closed_month(first_day_of_month):
+        price_store.save_month('TWSE', stock_number, first_day_of_month, data['data'], data['fields'])
+    return data['fields'], data['data']
+
+# Function to get one month of TPEx daily records, returns the rows, empty if the stock has none that month, or None if the request failed
+# Closed months are served from the local price store and only fetched once
+def fetch_tpex_month(stock_number, first_day_of_month):
+    stored = price_store.load_month('TPEX', stock_number, first_day_of_month)
+    if stored is not None:
+        return stored[1]
 
-    # Make the request and parse the JSON response
+    taiwan_date_string_for_url_encoded = get_taiwan_date_url_string(first_day_of_month)
+    url = f'https://www.tpex.org.tw/web/stock/aftertrading/daily_trading_info/st43_result.php?l=zh-tw&d={taiwan_date_string_for_url_encoded}&stkno={stock_number}'
     data = fetch_data(url)
 
-    # Check if the request was successful
-    if data.get('stat') == 'OK':
-        # Extract the fields and data from the response
-        fields = data['fields']
-        stock_data = data['data']
-
-        # Find the index of the 'Closing Price' field
-        closing_price_index = fields.index('Closing Price')
-
-        # Find the index of the input date in the data
-        input_date_index = next((i for i, record in enumerate(stock_data) if record[0] == input_date.strftime('%Y/%m/%d')), None)
-
-        if input_date_index is not None:
-            input_date_index = input_date_index
-            # Get the Closing Price for the input date
-            input_date_closing_price = float(stock_data[input_date_index][closing_price_index].replace(',', ''))
-
-            # Find the index of the earlier record based on n_records
-            earlier_index = input_date_index - n_records
-
-            # Check if there are enough earlier records in the current list
-            if earlier_index >= 0:
-                earlier_closing_price = 0
-                try:
-                    closing_price_string = stock_data[earlier_index][closing_price_index].replace(',', '')
-                    earlier_closing_price = float(closing_price_string)
-                except ValueError as e:
-                    logger.error(f"(TWSE) Illegal closing price in stock: {stock_number}, price string: {closing_price_string}")
-                    return StockPriceDifference(None, None, None, None)
-            else:
-                # Fetch additional records from earlier months
-                earlier_records = []
-                remaining_records = n_records
-
-                while remaining_records > 0:
-                    # Delay 2 seconds to avoid high frequency request blocking
-                    time.sleep(2)
-                    # Calculate the first day of the previous month
-                    first_day_of_month -= timedelta(days=1)
-                    formatted_date = first_day_of_month.strftime('%Y%m%d')
-
-                    # Construct the URL for fetching additional data
-                    url = f'https://www.twse.com.tw/rwd/en/afterTrading/STOCK_DAY?date={formatted_date}&stockNo={stock_number}&response=json'
-
-                    # Make the request and parse the JSON response
-                    additional_data = fetch_data(url)
-
-                    # Check if the request was successful
-                    if additional_data.get('stat') == 'OK':
-                        # Extract the additional data
-                        additional_stock_data = additional_data['data']
-
-                        # Add the additional data to the earlier_records list
-                        earlier_records.extend(additional_stock_data)
-                        remaining_records -= len(additional_stock_data)
-                    else:
-                        break
-
-                # Check if there are enough records after fetching additional data
-                if earlier_index < 0 and abs(earlier_index) < len(earlier_records):
-                    try:
-                        closing_price_string = earlier_records[earlier_index][closing_price_index].replace(',', '')
-                        earlier_closing_price = float(closing_price_string)
-                    except ValueError as e:
-                        logger.error(f"(TWSE) Illegal closing price in stock: {stock_number}, price string: {closing_price_string}")
-                        return StockPriceDifference(None, None, None, None)
-                else:
-                    logger.error(f"(TWSE) Not enough records for stock: {stock_number}")
-                    return StockPriceDifference(None, None, None, None)
-
-            # Calculate the difference between the latest and earlier Closing Prices
-            price_difference = input_date_closing_price - earlier_closing_price
-
-            # Calculate the percentage difference
-            percentage_difference = (price_difference / earlier_closing_price) * 100
-
-            # Round the results to a specific number of decimal places
-            rounded_price_difference = round(price_difference, 2)
-            rounded_percentage_difference = round(percentage_difference, 2)
-
-            return StockPriceDifference(rounded_price_difference, rounded_percentage_difference, input_date_closing_price, earlier_closing_price)
-        else:
-            logger.error(f"(TWSE) Input date not found in the data, date: {formatted_date} stock: {stock_number}")
-            return StockPriceDifference(None, None, None, None)
-    else:
-        logger.debug(f"(TWSE) Fail to retrieve data for stock: {stock_number}")
-        return StockPriceDifference(None, None, None, None)
+    if data is None:
+        return None
+    if data.get('iTotalRecords', 0) <= 0:
+        return []
+
+    if price_store.is_closed_month(first_day_of_month):
+        price_store.save_month('TPEX', stock_number, first_day_of_month, data['aaData'])
+    return data['aaData']
 
 def get_taiwan_date_string(date_time: datetime):
     year = date_time.year
@@ -154,129 +99,298 @@ def get_taiwan_date_url_string(date_time: datetime):
     taiwan_date_string_for_url_encoded = quote(taiwan_date_string_for_url)
     return taiwan_date_string_for_url_encoded
 
+# Column positions of the st43_result rows
+TPEX_FIELD_MAPPING = {
+    "Date": 0,
+    "Trade Volume": 1,
+    "Trade Value": 2,
+    "Opening Price": 3,
+    "Highest Price": 4,
+    "Lowest Price": 5,
+    "Closing Price": 6,
+    "Change": 7,
+    "Transaction": 8
+}
+
+HISTORY_COLUMNS = {
+    'open': 'Opening Price',
+    'high': 'Highest Price',
+    'low': 'Lowest Price',
+    'close': 'Closing Price',
+    'volume': 'Trade Volume',
+}
+
+# Function to list the first day of every month between two dates
+def get_month_starts(start_date: datetime, end_date: datetime):
+    month = start_date.replace(day=1)
+    months = []
+    while month <= end_date:
+        months.append(month)
+        month = (month + timedelta(days=32)).replace(day=1)
+    return months
+
+# Function to parse the rows of a month page into a date-indexed frame of floats
+def _parse_month_rows(market, fields, rows):
+    frame = pd.DataFrame(rows).astype(str)
+
+    if market == 'TWSE':
+        columns = {name: fields.index(field) for name, field in HISTORY_COLUMNS.items()}
+        dates = pd.to_datetime(frame[fields.index('Date')].str.strip(), format='%Y/%m/%d', errors='coerce')
+    else:
+        columns = {name: TPEX_FIELD_MAPPING[field] for name, field in HISTORY_COLUMNS.items()}
+        # Dates are in Taiwan years such as "112/12/05"
+        parts = frame[TPEX_FIELD_MAPPING['Date']].str.extract(r'(\d+)/(\d+)/(\d+)').astype(float)
+        dates = pd.to_datetime(pd.DataFrame({'year': parts[0] + 1911, 'month': parts[1], 'day': parts[2]}), errors='coerce')
+
+    history = pd.DataFrame({
+        name: pd.to_numeric(frame[index].str.replace(',', '', regex=False), errors='coerce').to_numpy()
+        for name, index in columns.items()
+    }, index=pd.DatetimeIndex(dates, name='date'))
+
+    # TPEx reports the volume in thousands of shares
+    if market == 'TPEX':
+        history['volume'] *= 1000
+
+    return history[history.index.notna()]
+
+# Function to get one month page of a market, returns (fields, rows) or None if the request failed
+def _fetch_month(market, stock_number, first_day_of_month):
+    if market == 'TWSE':
+        return fetch_twse_month(stock_number, first_day_of_month)
+    rows = fetch_tpex_month(stock_number, first_day_of_month)
+    return (list(TPEX_FIELD_MAPPING), rows) if rows is not None else None
+
+# Function to get the daily open/high/low/close/volume of a stock between two dates (inclusive)
+# The month pages the range needs are fetched concurrently, closed months come from the price store
+# market is looked up in the listing index when not given, returns None if no data is available
+# or if a month page couldn't be retrieved, a missing month would silently shift the lookback windows
+def get_price_history(stock_number, start_date: datetime, end_date: datetime, market=None):
+    markets = [market] if market else stock_listing.get_markets(stock_number)
+    months = get_month_starts(start_date, end_date)
+
+    for market in markets:
+        month_pages = fetch_scheduler.map_concurrently(lambda month: _fetch_month(market, stock_number, month), months)
+        failed = [month.strftime('%Y%m') for month, page in zip(months, month_pages) if page is None]
+        if failed:
+            logger.error(f"({market}) Fail to retrieve price history for stock: {stock_number} months: {', '.join(failed)}", extra={'symbol': stock_number, 'market': market})
+            return None
+        frames = []
+        for position, page in enumerate(month_pages):
+            if page[1]:
+                frames.append(_parse_month_rows(market, *page))
+            # Release the raw rows of a page once its records are parsed
+            month_pages[position] = None
+        if not frames:
+            continue
+
+        history = pd.concat(frames).sort_index()
+        history = history[~history.index.duplicated(keep='last')]
+        return history.loc[start_date:end_date]
+
+    return None
+
+# Function to get the daily history of a stock, oldest first, from n_records trading records before input_date up to input_date
+# The trading calendar tells how far back to look, a few more months are tried for stocks with suspended trading days
+def _get_lookback_history(stock_number, input_date: datetime, n_records, market=None):
+    earlier_trading_days = trading_calendar.previous_trading_days(input_date, n_records)
+    start_date = datetime.combine(earlier_trading_days[0], datetime.min.time()) if earlier_trading_days else input_date
+
+    for _ in range(3):
+        history = get_price_history(stock_number, start_date, input_date, market)
+        if history is None:
+            return None
+        if len(history) > n_records or input_date not in history.index:
+            return history.iloc[-(n_records + 1):]
+        start_date = (start_date.replace(day=1) - timedelta(days=1)).replace(day=1)
+    return history
+
+def _get_lookback_closes(stock_number, input_date: datetime, n_records, market=None):
+    history = _get_lookback_history(stock_number, input_date, n_records, market)
+    return history['close'] if history is not None else None
+
+# Function to compute the price difference of a stock in one market
+def _get_market_price_difference(market, stock_number, date_time, n_records):
+    input_date = datetime.strptime(date_time, '%Y%m%d')
+    closes = _get_lookback_closes(stock_number, input_date, n_records, market)
+
+    if closes is None:
+        logger.debug(f"({market}) Fail to retrieve data for stock: {stock_number}", extra={'symbol': stock_number, 'market': market})
+        return StockPriceDifference(None, None, None, None)
+
+    if input_date not in closes.index:
+        logger.error(f"({market}) Input date not found in the data, date: {date_time} stock: {stock_number}", extra={'symbol': stock_number, 'market': market})
+        return StockPriceDifference(None, None, None, None)
+
+    if len(closes) <= n_records:
+        logger.error(f"({market}) Not enough records for stock: {stock_number}", extra={'symbol': stock_number, 'market': market})
+        return StockPriceDifference(None, None, None, None)
+
+    input_date_closing_price = closes.iloc[-1]
+    earlier_closing_price = closes.iloc[0]
+    if pd.isna(input_date_closing_price) or pd.isna(earlier_closing_price) or earlier_closing_price == 0:
+        logger.error(f"({market}) Illegal closing price in stock: {stock_number}", extra={'symbol': stock_number, 'market': market})
+        return StockPriceDifference(None, None, None, None)
+
+    # Calculate the difference between the latest and earlier Closing Prices
+    price_difference = input_date_closing_price - earlier_closing_price
+
+    # Calculate the percentage difference
+    percentage_difference = (price_difference / earlier_closing_price) * 100
+
+    # Round the results to a specific number of decimal places
+    rounded_price_difference = round(float(price_difference), 2)
+    rounded_percentage_difference = round(float(percentage_difference), 2)
+
+    return StockPriceDifference(rounded_price_difference, rounded_percentage_difference, float(input_date_closing_price), float(earlier_closing_price))
+
+def get_stock_price_difference(stock_number, date_time, n_records):
+    return _get_market_price_difference('TWSE', stock_number, date_time, n_records)
+
 def get_tpex_stock_price_difference(stock_number, date_time_string, n_records):
-    # Parse input date_time to extract the year
-    input_date = datetime.strptime(date_time_string, '%Y%m%d')
-    first_day_of_month = input_date.replace(day=1)
+    return _get_market_price_difference('TPEX', stock_number, date_time_string, n_records)
 
-    taiwan_date_string_for_url_encoded = get_taiwan_date_url_string(input_date)
+# Function to parse a price string such as "1,234.50", returns None for "--" or empty values
+def parse_price(price_string):
+    try:
+        return float(price_string.replace(',', ''))
+    except (AttributeError, ValueError):
+        return None
+
+# Function to find the column index of the first field matching one of the given names
+def _find_field_index(fields, names):
+    for i, field in enumerate(fields):
+        if field.strip() in names:
+            return i
+    return None
 
-    # Construct the URL for fetching data from TPEx
-    url = f'https://www.tpex.org.tw/web/stock/aftertrading/daily_trading_info/st43_result.php?l=zh-tw&d={taiwan_date_string_for_url_encoded}&stkno={stock_number}'
+# Function to build {stock_number: [close, volume]} from the rows of an all-market table
+def _parse_daily_quotes(records, symbol_index, close_index, volume_index):
+    return {
+        record[symbol_index].strip(): [parse_price(record[close_index]), parse_price(record[volume_index]) if volume_index is not None else None]
+        for record in records
+    }
 
-    # Make the request and parse the JSON response
+# Function to get the all-market TWSE closing prices and volumes of a date, returns {stock_number: [close, volume]}
+# An empty dict means the date is not a trading day, None means the request failed
+def fetch_twse_daily_quotes(date_time: datetime):
+    url = f'https://www.twse.com.tw/rwd/zh/afterTrading/MI_INDEX?date={date_time.strftime("%Y%m%d")}&type=ALLBUT0999&response=json'
     data = fetch_data(url)
 
-    # Define the field mapping structure
-    field_mapping = {
-        "Date": 0,
-        "Trade Volume": 1,
-        "Trade Value": 2,
-        "Opening Price": 3,
-        "Highest Price": 4,
-        "Lowest Price": 5,
-        "Closing Price": 6,
-        "Change": 7,
-        "Transaction": 8
-    }
+    if data is None:
+        return None
+    if data.get('stat') != 'OK':
+        return {}
+
+    # The per-stock table is one of several tables in the response
+    tables = data.get('tables') or [{'fields': data.get('fields9', []), 'data': data.get('data9', [])}]
+    for table in tables:
+        fields = table.get('fields') or []
+        symbol_index = _find_field_index(fields, ('證券代號',))
+        close_index = _find_field_index(fields, ('收盤價',))
+        volume_index = _find_field_index(fields, ('成交股數',))
+        if symbol_index is not None and close_index is not None:
+            return _parse_daily_quotes(table.get('data', []), symbol_index, close_index, volume_index)
+    return {}
+
+# Function to get the all-market TPEx closing prices and volumes of a date, returns {stock_number: [close, volume]}
+# An empty dict means the date is not a trading day, None means the request failed
+def fetch_tpex_daily_quotes(date_time: datetime):
+    taiwan_date_string_encoded = quote(get_taiwan_date_string(date_time))
+    url = f'https://www.tpex.org.tw/web/stock/aftertrading/daily_close_quotes/stk_quote_result.php?l=zh-tw&d={taiwan_date_string_encoded}&o=json'
+    data = fetch_data(url)
 
-    # Check if the request was successful
-    if data.get('iTotalRecords', 0) > 0:
-        # Extract the data
-        stock_data = data['aaData']
-
-         # Create the Taiwan date string with year for aaData searching
-        taiwan_date_string_with_year = get_taiwan_date_string(input_date)
-
-        # Find the index of the input date in the data
-        input_date_index = next((i for i, record in enumerate(stock_data) if record[field_mapping["Date"]] == taiwan_date_string_with_year), None)
-
-        if input_date_index is not None:
-            # Get the Closing Price for the input date
-            input_date_closing_price = float(stock_data[input_date_index][field_mapping["Closing Price"]].replace(',', ''))
-
-            # Find the index of the earlier record based on n_records
-            earlier_index = input_date_index - n_records
-
-            # Check if there are enough earlier records in the current list
-            if earlier_index >= 0:
-                earlier_closing_price = 0
-                try:
-                    closing_price_string = stock_data[earlier_index][field_mapping["Closing Price"]].replace(',', '')
-                    earlier_closing_price = float(closing_price_string)
-                except ValueError as e:
-                    logger.error(f"(TPEX) Illegal closing price in stock: {stock_number}, price string: {closing_price_string}")
-                    return StockPriceDifference(None, None, None, None)
-            else:
-                # Fetch additional records from earlier months
-                earlier_records = []
-                remaining_records = n_records
-
-                while remaining_records > 0:
-                    # Delay 2 seconds to avoid high frequency request blocking
-                    time.sleep(2)
-                    # Calculate the first day of the previous month
-                    first_day_of_month -= timedelta(days=1)
-                    taiwan_date_string_for_url_encoded = get_taiwan_date_url_string(first_day_of_month)
-
-                    # Construct the URL for fetching additional data
-                    url = f'https://www.tpex.org.tw/web/stock/aftertrading/daily_trading_info/st43_result.php?l=zh-tw&d={taiwan_date_string_for_url_encoded}&stkno={stock_number}'
-
-                    # Make the request and parse the JSON response
-                    additional_data = fetch_data(url)
-
-                    # Check if the request was successful
-                    if data.get('iTotalRecords', 0) > 0:
-                        # Extract the additional data
-                        additional_stock_data = additional_data['aaData']
-
-                        # Add the additional data to the earlier_records list
-                        earlier_records.extend(additional_stock_data)
-                        remaining_records -= len(additional_stock_data)
-                    else:
-                        break
-
-                # Check if there are enough records after fetching additional data
-                if earlier_index < 0 and abs(earlier_index) < len(earlier_records):
-                    try:
-                        closing_price_string = additional_stock_data[earlier_index][field_mapping["Closing Price"]].replace(',', '')
-                        earlier_closing_price = float(closing_price_string)
-                    except ValueError as e:
-                        logger.error(f"(TPEX) Illegal closing price in stock: {stock_number}, price string: {closing_price_string}")
-                        return StockPriceDifference(None, None, None, None)
-                else:
-                    logger.error(f"(TPEX) Not enough records for stock: {stock_number}")
-                    return StockPriceDifference(None, None, None, None)
-
-            # Calculate the difference between the latest and earlier Closing Prices
-            price_difference = input_date_closing_price - earlier_closing_price
-
-            # Calculate the percentage difference
-            percentage_difference = (price_difference / earlier_closing_price) * 100
-
-            # Round the results to a specific number of decimal places
-            rounded_price_difference = round(price_difference, 2)
-            rounded_percentage_difference = round(percentage_difference, 2)
-
-            return StockPriceDifference(rounded_price_difference, rounded_percentage_difference, input_date_closing_price, earlier_closing_price)
-        else:
-            logger.error(f"(TPEX) Input date not found in the data, date: {taiwan_date_string_for_url_encoded} stock: {stock_number}")
-            return StockPriceDifference(None, None, None, None)
+    if data is None:
+        return None
+
+    table = data['tables'][0] if data.get('tables') else {'fields': data.get('fields'), 'data': data.get('aaData', [])}
+    fields = table.get('fields') or []
+    records = table.get('data', [])
+    if fields:
+        symbol_index = _find_field_index(fields, ('代號',))
+        close_index = _find_field_index(fields, ('收盤',))
+        volume_index = _find_field_index(fields, ('成交股數',))
     else:
-        logger.debug(f"(TPEX) Fail to retrieve data for stock: {stock_number}")
-        return StockPriceDifference(None, None, None, None)
+        # The legacy aaData layout without field names starts with the symbol, name and close
+        # The volume column moved between versions (均價 comes before it), without its name it is left out
+        symbol_index, close_index, volume_index = 0, 2, None
+
+    if symbol_index is None or close_index is None:
+        return {}
+    return _parse_daily_quotes(records, symbol_index, close_index, volume_index)
+
+# Function to get the closing prices and volumes of both markets for a date as {stock_number: [close, volume]}
+# Stored snapshots are reused, returns None if any request failed
+def get_daily_quotes(date_time: datetime):
+    quotes = {}
+    for market, fetch_quotes in (('TWSE', fetch_twse_daily_quotes), ('TPEX', fetch_tpex_daily_quotes)):
+        market_quotes = price_store.load_snapshot(market, date_time)
+        if market_quotes is None:
+            market_quotes = fetch_quotes(date_time)
+            if market_quotes is None:
+                return None
+            # Only trust an empty response for past dates, today's file may not be published yet
+            if market_quotes or date_time.date() < datetime.now().date():
+                price_store.save_snapshot(market, date_time, market_quotes)
+        # Snapshots stored before volumes were kept only hold the close
+        quotes.update({stock_number: quote if isinstance(quote, list) else [quote, None] for stock_number, quote in market_quotes.items()})
+    return quotes
+
+def _get_daily_quote_series(date_time: datetime):
+    quotes = get_daily_quotes(date_time)
+    return quotes_to_series(quotes) if quotes is not None else None
+
+# Function to build date x stock_number matrices (float32) of closing prices and volumes for the last n_days trading days up to date_time
+def build_quote_matrices(date_time, n_days):
+    input_date = datetime.strptime(date_time, '%Y%m%d')
+    rows = {}
+
+    # The trading calendar tells exactly which dates to request, the day after input_date makes it inclusive
+    end_date = input_date + timedelta(days=1)
+    while len(rows) < n_days:
+        trading_days = [datetime(day.year, day.month, day.day) for day in trading_calendar.previous_trading_days(end_date, n_days - len(rows))]
+        if not trading_days:
+            break
+
+        # Each day's quotes are converted to float32 Series as soon as they arrive, the dicts are not kept
+        daily_quotes = fetch_scheduler.map_concurrently(_get_daily_quote_series, trading_days)
+        for trading_day, quotes in zip(trading_days, daily_quotes):
+            if quotes is None:
+                logger.error(f"Fail to retrieve daily quotes, date: {trading_day.strftime('%Y%m%d')}")
+                # A gap would silently shift the lookback window, stop with what we have
+                trading_days = []
+                break
+            if not quotes[0].empty:
+                rows[trading_day] = quotes
+            elif trading_day.date() < datetime.now().date():
+                # An unscheduled closure such as a typhoon day
+                trading_calendar.mark_non_trading_day(trading_day)
+
+        if not trading_days:
+            break
+        end_date = trading_days[0]
+
+    if len(rows) < n_days:
+        logger.error(f"Not enough trading days for quote matrices, found: {len(rows)} wanted: {n_days}")
+
+    return series_to_matrices(rows)
 
 def get_stock_data(stock_number, date_time, n_records):
 
-    # Attempt to get stock data using TWSE (priority)
-    stock_result = get_stock_price_difference(stock_number, date_time, n_records)
+    # Route the symbol to its market, TWSE is tried first when the listing index is not available
+    markets = stock_listing.get_markets(stock_number)
+    if not markets:
+        logger.debug(f"Skipping unlisted stock: {stock_number}", extra={'symbol': stock_number})
 
-    # If TWSE data is not available, try getting data from TPEx
-    if stock_result.input_date_closing_price is None:
-        tpex_result = get_tpex_stock_price_difference(stock_number, date_time, n_records)
-        return tpex_result
-    else:
-        return stock_result
+    stock_result = StockPriceDifference(None, None, None, None)
+    for market in markets:
+        if market == 'TWSE':
+            stock_result = get_stock_price_difference(stock_number, date_time, n_records)
+        else:
+            stock_result = get_tpex_stock_price_difference(stock_number, date_time, n_records)
+        if stock_result.input_date_closing_price is not None:
+            break
+
+    return stock_result
 
 def get_stock_data_today(stock_number, n_records):
     # Get today's date in the required format
@@ -285,57 +399,55 @@ def get_stock_data_today(stock_number, n_records):
     # Use today's date as the input for the original get_stock_data function
     return get_stock_data(stock_number, today_date, n_records)
 
-# Example usage for TWSE:
-twse_stock_number = "1303"
-twse_date_time = "20231101"
-twse_n_records = 5
-
-twse_result = get_stock_price_difference(twse_stock_number, twse_date_time, twse_n_records)
-print("TWSE Results:")
-print(f"The price difference is: {twse_result.price_difference}")
-print(f"The percentage difference is: {twse_result.percentage_difference}%")
-print(f"The closing price on the input date is: {twse_result.input_date_closing_price}")
-print(f"The closing price {twse_n_records} days earlier is: {twse_result.earlier_closing_price}")
-
-# Example usage for TPEx:
-tpex_stock_number = "1815"
-tpex_date_time = "20231205"
-tpex_n_records = 10
-
-tpex_result = get_tpex_stock_price_difference(tpex_stock_number, tpex_date_time, tpex_n_records)
-print("\nTPEx Results:")
-print(f"The price difference is: {tpex_result.price_difference}")
-print(f"The percentage difference is: {tpex_result.percentage_difference}%")
-print(f"The closing price on the input date is: {tpex_result.input_date_closing_price}")
-print(f"The closing price {tpex_n_records} days earlier is: {tpex_result.earlier_closing_price}")
-
-# Example usage for get_stock_data:
-stock_number = "1303"
-date_time = "20231101"  # Normal date-time format
-n_records = 2
-
-result = get_stock_data(stock_number, date_time, n_records)
-
-if result.input_date_closing_price is not None:
-    print("\nget_stock_data Results:")
+# Function to get the daily open/high/low/close/volume of a stock, oldest first, from n_records trading days before date_time up to date_time
+# Returns None if the stock has no record on date_time
+def get_lookback_history(stock_number, date_time, n_records):
+    input_date = datetime.strptime(date_time, '%Y%m%d')
+
+    # Route the symbol to its market, unlisted symbols are skipped without a request
+    for market in stock_listing.get_markets(stock_number):
+        history = _get_lookback_history(stock_number, input_date, n_records, market)
+        if history is not None and input_date in history.index:
+            return history
+
+    logger.debug(f"Fail to retrieve price history for stock: {stock_number}", extra={'symbol': stock_number})
+    return None
+
+# Function to print a price difference result
+def print_result(title, result, n_records):
+    if result.input_date_closing_price is None:
+        print(f"\n{title}: No stock data available.")
+        return
+    print(f"\n{title}:")
     print(f"The price difference is: {result.price_difference}")
     print(f"The percentage difference is: {result.percentage_difference}%")
     print(f"The closing price on the input date is: {result.input_date_closing_price}")
     print(f"The closing price {n_records} days earlier is: {result.earlier_closing_price}")
-else:
-    print("No stock data available.")
-
-# Example usage for get_stock_data_today:
-stock_number = "1303"
-n_records = 2
-
-result_today = get_stock_data_today(stock_number, n_records)
-
-if result_today.input_date_closing_price is not None:
-    print("\nget_stock_data_today Results for Today:")
-    print(f"The price difference is: {result_today.price_difference}")
-    print(f"The percentage difference is: {result_today.percentage_difference}%")
-    print(f"The closing price on the input date is: {result_today.input_date_closing_price}")
-    print(f"The closing price {n_records} days earlier is: {result_today.earlier_closing_price}")
-else:
-    print("No stock data available for today.")
+
+# Function to run the example lookups, each one requests live TWSE/TPEx data
+def run_examples():
+    print_result("TWSE Results", get_stock_price_difference("1303", "20231101", 5), 5)
+    print_result("TPEx Results", get_tpex_stock_price_difference("1815", "20231205", 10), 10)
+    print_result("get_stock_data Results", get_stock_data("1303", "20231101", 2), 2)
+    print_result("get_stock_data_today Results for Today", get_stock_data_today("1303", 2), 2)
+
+# Usage: stock_info.py lookup <stock_number> [--date YYYYMMDD] [--records N] | stock_info.py examples
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Price difference lookups against TWSE and TPEx')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    lookup_parser = subparsers.add_parser('lookup', help='price difference of one stock over n trading records')
+    lookup_parser.add_argument('stock_number')
+    lookup_parser.add_argument('--date', default=datetime.now().strftime('%Y%m%d'), help='input date (YYYYMMDD), default today')
+    lookup_parser.add_argument('--records', type=int, default=10, help='trading records between the two closing prices')
+    subparsers.add_parser('examples', help='run the example lookups')
+    args = parser.parse_args(argv)
+
+    if args.command == 'lookup':
+        print_result(f"{args.stock_number} on {args.date}", get_stock_data(args.stock_number, args.date, args.records), args.records)
+    else:
+        run_examples()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+
+import requests
+
+import http_client
+from data_paths import get_data_path
+from logger_config import setup_logger
+
+# Set up the logger
+logger = setup_logger()
+
+LISTING_FILENAME = 'stock_listing.json'
+
+# Bumped when the index gains entries, an older cached index is refreshed right away
+LISTING_VERSION = 2
+
+# Listed companies rarely change, refresh the index once a week
+LISTING_MAX_AGE = timedelta(days=7)
+
+TWSE_LISTING_URL = 'https://openapi.twse.com.tw/v1/opendata/t187ap03_L'
+TPEX_LISTING_URL = 'https://www.tpex.org.tw/openapi/v1/mopsfe_t187ap03_O'
+
+# ISIN code tables of every listed security (strMode 2: TWSE, 4: TPEx), the company listings don't hold ETFs, ETNs and the like
+ISIN_LISTING_URLS = {
+    'TWSE': 'https://isin.twse.com.tw/isin/C_public.jsp?strMode=2',
+    'TPEX': 'https://isin.twse.com.tw/isin/C_public.jsp?strMode=4',
+}
+
+# A stale index is used for this long before the exchanges are asked again
+STALE_RETRY = timedelta(hours=1)
+
+_listing = None
+_listing_expires_at = None
+_listing_lock = threading.Lock()
+
+# Function to download a listed-company file and map each symbol to its market, name and industry
+def _fetch_companies(url, market, symbol_key, name_key, industry_key):
+    response = http_client.get(url)
+    response.raise_for_status()
+    companies = {}
+    for company in response.json():
+        symbol = str(company.get(symbol_key, '')).strip()
+        if symbol:
+            companies[symbol] = {
+                'market': market,
+                'name': str(company.get(name_key, '')).strip(),
+                'industry': str(company.get(industry_key, '')).strip(),
+            }
+    return companies
+
+# Collects the cell texts of every table row of an ISIN page
+class _IsinRowParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self._cells = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._cells = []
+        elif tag == 'td' and self._cells is not None:
+            self._cells.append('')
+
+    def handle_endtag(self, tag):
+        if tag == 'tr' and self._cells is not None:
+            self.rows.append([cell.strip() for cell in self._cells])
+            self._cells = None
+
+    def handle_data(self, data):
+        if self._cells:
+            self._cells[-1] += data
+
+# Function to download an ISIN code table and map each security to its market, name and industry
+# Rows are grouped under one-cell section rows (股票, ETF, ETN, 特別股, ...), warrant sections are left out
+def _fetch_isin_securities(url, market):
+    response = http_client.get(url)
+    response.raise_for_status()
+    parser = _IsinRowParser()
+    # The tables are published in Big5 (MS950)
+    parser.feed(response.content.decode('cp950', errors='replace'))
+    parser.close()
+
+    securities = {}
+    section = ''
+    for cells in parser.rows:
+        if len(cells) == 1:
+            section = cells[0]
+            continue
+        if '權證' in section or len(cells) < 5:
+            continue
+        # The first cell is the symbol and name separated by a full-width space, e.g. "0050　元大台灣50"
+        symbol, _, name = cells[0].replace('\u3000', ' ').partition(' ')
+        if symbol and symbol[0].isdigit():
+            securities[symbol] = {'market': market, 'name': name.strip(), 'industry': cells[4]}
+    return securities
+
+# Function to download the listings of both exchanges, returns None if any download fails
+# Companies come with their industry code, the ISIN tables add the other securities such as ETFs (0050, 00878)
+def fetch_listing():
+    try:
+        stocks = {}
+        for market, url in ISIN_LISTING_URLS.items():
+            stocks.update(_fetch_isin_securities(url, market))
+        stocks.update(_fetch_companies(TWSE_LISTING_URL, 'TWSE', '公司代號', '公司簡稱', '產業別'))
+        stocks.update(_fetch_companies(TPEX_LISTING_URL, 'TPEX', 'SecuritiesCompanyCode', 'CompanyAbbreviation', 'SecuritiesIndustryCode'))
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error(f"Fail to retrieve stock listing: {e}")
+        return None
+    return stocks
+
+# Function to get the symbol index, refreshed from the exchanges when the cached file is missing or stale
+# A stale index is still used when the refresh fails, returns None if no index is available at all
+def get_listing():
+    global _listing, _listing_expires_at
+    with _listing_lock:
+        # Kept in memory until it's due for a refresh, a long-running process picks up listing changes too
+        if _listing is not None and datetime.now() < _listing_expires_at:
+            return _listing
+
+        listing_path = get_data_path(LISTING_FILENAME)
+        cached = None
+        if os.path.exists(listing_path):
+            with open(listing_path, 'r', encoding='utf-8') as file:
+                cached = json.load(file)
+
+        if (cached is not None and cached.get('version') == LISTING_VERSION
+                and datetime.now() - datetime.fromisoformat(cached['updated_at']) < LISTING_MAX_AGE):
+            _listing = cached['stocks']
+            _listing_expires_at = datetime.fromisoformat(cached['updated_at']) + LISTING_MAX_AGE
+            return _listing
+
+        stocks = fetch_listing()
+        if stocks:
+            with open(listing_path, 'w', encoding='utf-8') as file:
+                json.dump({'version': LISTING_VERSION, 'updated_at': datetime.now().isoformat(timespec='seconds'), 'stocks': stocks}, file, ensure_ascii=False)
+            _listing = stocks
+            _listing_expires_at = datetime.now() + LISTING_MAX_AGE
+        elif cached is not None:
+            logger.warning(f"Using stale stock listing from {cached['updated_at']}")
+            _listing = cached['stocks']
+            _listing_expires_at = datetime.now() + STALE_RETRY
+        elif _listing is not None:
+            logger.warning("Using the stock listing already in memory")
+            _listing_expires_at = datetime.now() + STALE_RETRY
+        return _listing
+
+# Function to look up a symbol, returns {'market', 'name', 'industry'} or None if it isn't listed
+def lookup(stock_number):
+    listing = get_listing()
+    if listing is None:
+        return None
+    return listing.get(stock_number)
+
+# Function to get the markets to request a symbol from
+# Returns an empty list for unlisted symbols and both markets (TWSE first) when no index is available
+def get_markets(stock_number):
+    listing = get_listing()
+    if listing is None:
+        return ['TWSE', 'TPEX']
+    entry = listing.get(stock_number)
+    if entry is None:
+        return []
+    return [entry['market']]
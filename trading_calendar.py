@@ -0,0 +1,158 @@
+import bisect
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+
+import requests
+
+import http_client
+from data_paths import get_data_path
+from logger_config import setup_logger
+
+# Set up the logger
+logger = setup_logger()
+
+# Names of schedule entries which are informational and still trading days
+TRADING_DAY_NOTES = ('開始交易', '最後交易')
+
+_calendars = {}
+_calendars_lock = threading.Lock()
+
+def _to_date(date_time):
+    return date_time.date() if isinstance(date_time, datetime) else date_time
+
+def _cache_path(year):
+    return get_data_path(f'trading_calendar_{year}.json')
+
+# Function to parse a schedule date such as "2024-01-01" or "113/01/01"
+def _parse_schedule_date(date_string, year):
+    date_string = date_string.strip()
+    try:
+        return datetime.strptime(date_string, '%Y-%m-%d').date()
+    except ValueError:
+        pass
+    try:
+        taiwan_year, month, day = (int(part) for part in date_string.split('/'))
+        return date(taiwan_year + 1911, month, day)
+    except ValueError:
+        pass
+    # Some years list dates as "01月01日"
+    try:
+        return datetime.strptime(f'{year}{date_string}', '%Y%m月%d日').date()
+    except ValueError:
+        return None
+
+# Function to download the exchange holiday schedule of a year, returns a set of closed dates or None
+def fetch_holidays(year):
+    url = f'https://www.twse.com.tw/rwd/zh/holidaySchedule/holidaySchedule?date={year}0101&response=json'
+    try:
+        response = http_client.get(url)
+        response.raise_for_status()
+        data = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error(f"Fail to retrieve holiday schedule, year: {year} error: {e}")
+        return None
+
+    if str(data.get('stat', '')).upper() != 'OK':
+        logger.error(f"Holiday schedule not available, year: {year}")
+        return None
+
+    holidays = set()
+    for record in data.get('data', []):
+        if any(note in record[1] for note in TRADING_DAY_NOTES):
+            continue
+        holiday = _parse_schedule_date(record[0], year)
+        if holiday is not None and holiday.year == year:
+            holidays.add(holiday)
+    return holidays
+
+class TradingCalendar:
+    def __init__(self, year, holidays, fallback=False):
+        self.year = year
+        self.holidays = set(holidays)
+        # Built from weekdays only because the schedule couldn't be downloaded
+        self.fallback = fallback
+        day = date(year, 1, 1)
+        self.trading_days = []
+        while day.year == year:
+            if day.weekday() < 5 and day not in self.holidays:
+                self.trading_days.append(day)
+            day += timedelta(days=1)
+        self.positions = {day: i for i, day in enumerate(self.trading_days)}
+
+# Function to get the calendar of a year, built once from the holiday schedule and cached on disk
+# Falls back to weekdays only (not cached) when the schedule can't be downloaded
+def get_calendar(year):
+    with _calendars_lock:
+        if year in _calendars:
+            return _calendars[year]
+
+        holidays = None
+        cache_path = _cache_path(year)
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r') as file:
+                holidays = [date.fromisoformat(day) for day in json.load(file)['holidays']]
+        else:
+            holidays = fetch_holidays(year)
+            if holidays is not None:
+                _save_holidays(year, holidays)
+            else:
+                logger.warning(f"Using weekdays as trading days for year: {year}")
+                calendar = TradingCalendar(year, [], fallback=True)
+                _calendars[year] = calendar
+                return calendar
+
+        calendar = TradingCalendar(year, holidays)
+        _calendars[year] = calendar
+        return calendar
+
+# Function to drop the weekday-only calendars so a long-running process downloads their schedule again
+def refresh():
+    with _calendars_lock:
+        for year in [year for year, calendar in _calendars.items() if calendar.fallback]:
+            del _calendars[year]
+
+def _save_holidays(year, holidays):
+    with open(_cache_path(year), 'w') as file:
+        json.dump({'year': year, 'holidays': sorted(day.isoformat() for day in holidays)}, file, indent=4)
+
+# Function to record an observed closure such as a typhoon day
+# A weekday-only calendar is not written to disk, the cached file would stop the real schedule from being downloaded
+def mark_non_trading_day(date_time):
+    day = _to_date(date_time)
+    calendar = get_calendar(day.year)
+    if calendar.fallback:
+        # Try the schedule again first, the closure may already be in it
+        refresh()
+        calendar = get_calendar(day.year)
+    if day not in calendar.positions:
+        return
+    logger.info(f"Marking {day.isoformat()} as non-trading day")
+    holidays = calendar.holidays | {day}
+    with _calendars_lock:
+        if not calendar.fallback:
+            _save_holidays(day.year, holidays)
+        _calendars[day.year] = TradingCalendar(day.year, holidays, fallback=calendar.fallback)
+
+# Function to check if a date (today by default) is a trading day
+def is_trading_day(date_time=None):
+    day = _to_date(date_time or datetime.now())
+    return day in get_calendar(day.year).positions
+
+# Function to get the n trading days before a date (excluding the date itself), oldest first
+def previous_trading_days(date_time, n):
+    day = _to_date(date_time)
+    year = day.year
+    calendar = get_calendar(year)
+    index = bisect.bisect_left(calendar.trading_days, day)
+    result = calendar.trading_days[max(0, index - n):index]
+
+    # Continue into earlier years until there are enough days
+    while len(result) < n:
+        year -= 1
+        earlier_days = get_calendar(year).trading_days
+        if not earlier_days:
+            break
+        result = earlier_days[-(n - len(result)):] + result
+    return result
@@ -3,8 +3,15 @@
 # Get the path to the current script
 SCRIPT_PATH="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 
-# Remove daily report cron jobs
+# Stop and remove the report daemon
+if [ -f /etc/systemd/system/twstockreporter.service ]; then
+    sudo systemctl disable --now twstockreporter.service
+    sudo rm /etc/systemd/system/twstockreporter.service
+    sudo systemctl daemon-reload
+fi
+
+# Remove daily report cron jobs of earlier installs
 (crontab -l | grep -v "$SCRIPT_PATH/daily_3insti_report.py") | crontab -
 (crontab -l | grep -v "$SCRIPT_PATH/daily_stock_report.py") | crontab -
 
-echo "Uninstallation complete. Daily stock report script unscheduled."
+echo "Uninstallation complete. Daily reports unscheduled."